@@ -0,0 +1,14 @@
+CREATE TABLE IF NOT EXISTS prod_source.etl_watermarks (
+    database_name               String,
+    table_name                  String,
+    high_watermark              DateTime,
+    mod_min                     Nullable(DateTime),
+    mod_max                     Nullable(DateTime),
+    rows_loaded                 UInt64,
+    job_name                    String,
+    run_metadata                String,
+    updated_at                  DateTime64(3) DEFAULT now64(3)
+)
+ENGINE = ReplacingMergeTree(updated_at)
+ORDER BY (database_name, table_name)
+SETTINGS index_granularity = 8192
\ No newline at end of file
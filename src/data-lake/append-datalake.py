@@ -7,6 +7,11 @@ from sqlalchemy.exc import SQLAlchemyError
 import logging
 import pyarrow.parquet as pq
 import pyarrow as pa
+from gcs_upload import upload_to_bucket
+from partitioned_dataset import append_partitioned, commit_manifest, PartitionedPartWriter
+from mssql_extract import fetch_arrow_schema, iter_query_chunks, extract_ranges_parallel
+from ingest_watermark import load_watermark, save_watermark, incremental_filter, WatermarkTracker
+from sqlalchemy import text
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -28,6 +33,32 @@ BUCKET_NAME = "data-lake-vta-test"
 GCS_FOLDER = "raw/"
 LOCAL_FILE = "RETAILTRANSACTIONSALESTRANS.parquet"
 
+# "partitioned": upload each extraction as new parts of raw/RETAILTRANSACTIONSALESTRANS/TRANSDATE_month=YYYY-MM/
+# "file": legacy mode, rewrite and re-upload the whole single Parquet file
+APPEND_MODE = os.getenv("DATALAKE_APPEND_MODE", "partitioned")
+DATASET_PATH = f"{GCS_FOLDER}RETAILTRANSACTIONSALESTRANS/"
+PARTITION_COLUMN = "TRANSDATE"
+
+# MSSQL Table Configuration
+TABLE_NAME = "RETAILTRANSACTIONSALESTRANS"
+BASE_QUERY = f"SELECT * FROM dbo.{TABLE_NAME} WITH (NOLOCK)"
+
+# "incremental": rows changed since the last successful ingest (watermark on MODIFIEDDATETIME/RECID)
+# "month": one whole TRANSDATE month (DATALAKE_MONTH), e.g. to backfill history
+EXTRACT_MODE = os.getenv("DATALAKE_EXTRACT_MODE", "incremental")
+BACKFILL_MONTH = os.getenv("DATALAKE_MONTH", "2025-01")
+INITIAL_SINCE = os.getenv("DATALAKE_INITIAL_SINCE", "2025-01-01")  # Lower bound of the first incremental run
+LOOKBACK_MINUTES = int(os.getenv("DATALAKE_LOOKBACK_MINUTES", "0"))
+
+# "stream": fetch in chunks straight into Parquet row groups (flat memory), "dataframe": one pd.read_sql
+FETCH_MODE = os.getenv("DATALAKE_FETCH_MODE", "stream")
+CHUNK_SIZE = int(os.getenv("DATALAKE_CHUNK_SIZE", "100000"))
+
+# Above 1: split RANGE_COLUMN (RECID or a date column) into ranges fetched concurrently, each written as its own
+# part(s). MAX_CONNECTIONS caps the concurrent connections opened on the production server.
+MAX_CONNECTIONS = int(os.getenv("DATALAKE_MAX_CONNECTIONS", "1"))
+RANGE_COLUMN = os.getenv("DATALAKE_RANGE_COLUMN", "RECID")
+
 def get_sqlalchemy_engine():
     """Create an SQLAlchemy engine using pyodbc."""
     try:
@@ -44,16 +75,24 @@ def get_sqlalchemy_engine():
         logging.error(f"Error creating SQLAlchemy engine: {e}")
         return None
 
-def fetch_data():
+def build_query(watermark):
+    """Extraction query and parameters. Predicates are sargable: bare columns compared with parameters."""
+    if EXTRACT_MODE == "month":
+        start = pd.Timestamp(f"{BACKFILL_MONTH}-01")
+        params = {"start": start.to_pydatetime(), "end": (start + pd.offsets.MonthBegin(1)).to_pydatetime()}
+        return f"{BASE_QUERY} WHERE TRANSDATE >= :start AND TRANSDATE < :end", params
+    where, params = incremental_filter(watermark, lookback_minutes=LOOKBACK_MINUTES, initial_since=INITIAL_SINCE)
+    return f"{BASE_QUERY} {where}", params
+
+def fetch_data(query, params):
     """Fetch data from MSSQL using SQLAlchemy."""
     try:
         engine = get_sqlalchemy_engine()
         if not engine:
             return None
         
-        query = "SELECT  * FROM dbo.RETAILTRANSACTIONSALESTRANS WITH (NOLOCK) WHERE CAST(TRANSDATE AS DATE) BETWEEN '2025-01-01' AND '2025-01-31'"
         with engine.connect() as conn:
-            df = pd.read_sql(query, con=conn)
+            df = pd.read_sql(text(query), con=conn, params=params)
 
         if df.empty:
             logging.warning("No data fetched from SQL Server.")
@@ -82,22 +121,91 @@ def append_to_parquet(df, filename):
 
         file_size = os.path.getsize(filename) / 1024
         logging.info(f"Data written to {filename} ({file_size:.2f} KB)")
+        return True
     except Exception as e:
         logging.error(f"Error appending to Parquet file: {e}")
+        return False
 
 def upload_to_gcs(local_file, bucket_name, destination_blob):
     """Upload file to Google Cloud Storage (GCS)."""
     try:
         client = storage.Client()
         bucket = client.bucket(bucket_name)
-        blob = bucket.blob(destination_blob)
-        blob.upload_from_filename(local_file)
+        upload_to_bucket(bucket, local_file, destination_blob)  # Parallel composite upload for large files
         logging.info(f"File uploaded to gs://{bucket_name}/{destination_blob}")
+        return True
     except Exception as e:
         logging.error(f"Error uploading to GCS: {e}")
+        return False
+
+def append_to_dataset(df, bucket_name, dataset_path, partition_column):
+    """Append data as new parts of a partitioned dataset on GCS (only the new rows are written)."""
+    try:
+        bucket = storage.Client().bucket(bucket_name)
+        entries = append_partitioned(df, bucket, dataset_path, partition_column)
+        logging.info(f"Appended {len(df)} rows to gs://{bucket_name}/{dataset_path} in {len(entries)} part(s).")
+        return True
+    except Exception as e:
+        logging.error(f"Error appending to partitioned dataset: {e}")
+        return False
+
+def stream_to_dataset(bucket_name, dataset_path, partition_column, query, params, tracker):
+    """Fetch in chunks and write them as partitioned parts with a fixed schema, without a full DataFrame."""
+    try:
+        engine = get_sqlalchemy_engine()
+        if not engine:
+            return False
+        schema = fetch_arrow_schema(engine, TABLE_NAME)
+        bucket = storage.Client().bucket(bucket_name)
+
+        def write_parts(index, chunks):
+            with PartitionedPartWriter(bucket, dataset_path, partition_column, schema) as writer:
+                for chunk in chunks:
+                    writer.write(chunk)
+                    tracker.update(chunk)
+                    logging.info(f"Fetched chunk of {len(chunk)} rows ({tracker.rows} so far).")
+            return writer.entries
+
+        if MAX_CONNECTIONS > 1:
+            results = extract_ranges_parallel(engine, query, RANGE_COLUMN, write_parts, params=params,
+                                              max_connections=MAX_CONNECTIONS, chunk_size=CHUNK_SIZE)
+            entries = [entry for range_entries in results for entry in range_entries]
+        else:
+            entries = write_parts(0, iter_query_chunks(engine, query, chunk_size=CHUNK_SIZE, params=params))
+
+        if not entries:
+            logging.warning("No data fetched from SQL Server.")
+            return True
+        # All ranges committed in one manifest update: either the whole extraction becomes visible or none of it
+        commit_manifest(bucket, dataset_path, entries, partition_column)
+        logging.info(f"Appended {tracker.rows} rows to gs://{bucket_name}/{dataset_path} in {len(entries)} part(s).")
+        return True
+    except SQLAlchemyError as e:
+        logging.error(f"SQLAlchemy Error fetching data: {e}")
+        return False
+    except Exception as e:
+        logging.error(f"Error streaming to partitioned dataset: {e}")
+        return False
 
 if __name__ == "__main__":
-    df = fetch_data()
-    if df is not None:
-        append_to_parquet(df, LOCAL_FILE)  # Append instead of overwriting
-        upload_to_gcs(LOCAL_FILE, BUCKET_NAME, f"{GCS_FOLDER}{LOCAL_FILE}")
+    bucket = storage.Client().bucket(BUCKET_NAME)
+    watermark = load_watermark(bucket, TABLE_NAME) if EXTRACT_MODE == "incremental" else None
+    query, params = build_query(watermark)
+    tracker = WatermarkTracker(watermark)
+    logging.info(f"Extracting {TABLE_NAME} ({EXTRACT_MODE}) with parameters {params}.")
+
+    if FETCH_MODE == "stream" and APPEND_MODE == "partitioned":
+        succeeded = stream_to_dataset(BUCKET_NAME, DATASET_PATH, PARTITION_COLUMN, query, params, tracker)
+    else:
+        df = fetch_data(query, params)
+        succeeded = False
+        if df is not None:
+            tracker.update(df)
+            if APPEND_MODE == "partitioned":
+                succeeded = append_to_dataset(df, BUCKET_NAME, DATASET_PATH, PARTITION_COLUMN)
+            else:
+                succeeded = append_to_parquet(df, LOCAL_FILE) and upload_to_gcs(LOCAL_FILE, BUCKET_NAME, f"{GCS_FOLDER}{LOCAL_FILE}")
+
+    # Advance the watermark only once the rows are safely on GCS
+    if succeeded and EXTRACT_MODE == "incremental" and tracker.rows:
+        save_watermark(bucket, TABLE_NAME, tracker.watermark, tracker.rows)
@@ -0,0 +1,114 @@
+# Uploads for the data-lake scripts. Large files (or in-memory buffers) are split into parts uploaded concurrently
+# as temporary objects, composed server-side into the destination object and verified against a CRC32C computed
+# locally. Small ones use a single request.
+
+import io
+import os
+import base64
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import google_crc32c
+
+# Sources of at least this size use a parallel composite upload
+COMPOSITE_UPLOAD_MIN_BYTES = int(os.getenv("GCS_COMPOSITE_UPLOAD_MIN_BYTES", str(64 * 1024 * 1024)))
+UPLOAD_PART_SIZE = int(os.getenv("GCS_UPLOAD_PART_SIZE", str(32 * 1024 * 1024)))
+UPLOAD_WORKERS = int(os.getenv("GCS_UPLOAD_WORKERS", "8"))
+
+# GCS composes at most 32 source objects per request
+MAX_COMPOSE_SOURCES = 32
+
+
+def _source_size(source):
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    return memoryview(source).nbytes
+
+
+def _read_range(source, start, end):
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+    return bytes(memoryview(source)[start:end])
+
+
+def _crc32c(source, size, block_size=8 * 1024 * 1024):
+    checksum = google_crc32c.Checksum()
+    for start in range(0, size, block_size):
+        checksum.update(_read_range(source, start, min(start + block_size, size)))
+    return base64.b64encode(checksum.digest()).decode("utf-8")
+
+
+def _compose(bucket, destination_blob, sources, content_type, intermediates):
+    """
+    Composes `sources` into the destination, through intermediate objects (appended to `intermediates` for
+    cleanup) when there are more than 32.
+    """
+    while len(sources) > MAX_COMPOSE_SOURCES:
+        grouped = []
+        for index in range(0, len(sources), MAX_COMPOSE_SOURCES):
+            intermediate = bucket.blob(f"{sources[0].name}.compose-{len(intermediates)}-{index}")
+            intermediate.compose(sources[index:index + MAX_COMPOSE_SOURCES])
+            grouped.append(intermediate)
+            intermediates.append(intermediate)
+        sources = grouped
+
+    destination = bucket.blob(destination_blob)
+    destination.content_type = content_type
+    destination.compose(sources)
+    return destination
+
+
+def upload_to_bucket(bucket, source, destination_blob, content_type="application/octet-stream"):
+    """
+    Uploads `source` (a local file path, or bytes / bytearray / memoryview / BytesIO buffer) to `destination_blob`.
+    Large sources are uploaded as parallel parts composed server-side; the final object's CRC32C is compared
+    with the local one and a mismatch raises IOError. Returns the destination blob.
+    """
+    if isinstance(source, io.BytesIO):
+        source = source.getbuffer()
+    size = _source_size(source)
+
+    if size < COMPOSITE_UPLOAD_MIN_BYTES or UPLOAD_WORKERS <= 1:
+        blob = bucket.blob(destination_blob)
+        # checksum="crc32c": the client sends the checksum and the upload fails if GCS computes a different one
+        if isinstance(source, str):
+            blob.upload_from_filename(source, content_type=content_type, checksum="crc32c")
+        else:
+            blob.upload_from_file(io.BytesIO(source), size=size, content_type=content_type, checksum="crc32c")
+        return blob
+
+    prefix = f"{destination_blob}.parts-{uuid.uuid4().hex[:8]}"
+    offsets = list(range(0, size, UPLOAD_PART_SIZE))
+
+    def upload_part(index):
+        start = offsets[index]
+        part = bucket.blob(f"{prefix}/{index:05d}")
+        part.upload_from_string(_read_range(source, start, min(start + UPLOAD_PART_SIZE, size)), checksum="crc32c")
+        return part
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        futures = [executor.submit(upload_part, index) for index in range(len(offsets))]
+    parts = [future.result() for future in futures if future.exception() is None]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+
+    intermediates = []
+    try:
+        if errors:
+            raise errors[0]
+        destination = _compose(bucket, destination_blob, parts, content_type, intermediates)
+    finally:
+        for temporary in parts + intermediates:
+            try:
+                temporary.delete()
+            except Exception as e:
+                logging.warning(f"Failed to delete temporary upload part {temporary.name}: {e}")
+
+    destination.reload()
+    expected = _crc32c(source, size)
+    if destination.crc32c != expected:
+        raise IOError(f"CRC32C mismatch after composing gs://{bucket.name}/{destination_blob}: expected {expected}, got {destination.crc32c}")
+    logging.info(f"Uploaded gs://{bucket.name}/{destination_blob} ({size / 1024 / 1024:.1f} MB) in {len(parts)} parallel parts.")
+    return destination
@@ -1,11 +1,16 @@
 # This code use for Ingesting data from ax mssql to google storage /raw
 
+import io
 import os
 import urllib.parse
 import pandas as pd
 from google.cloud import storage
 from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
+from gcs_upload import upload_to_bucket
+from mssql_extract import fetch_arrow_schema, iter_query_chunks, stream_query_to_parquet
+from partitioned_dataset import PartitionedPartWriter, commit_manifest
+from ingest_watermark import load_watermark, save_watermark, incremental_filter, WatermarkTracker
 
 # Set Google Cloud credentials
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "/Users/wind2808/Downloads/windy-forge-404504-8bb02bfe64e6.json"
@@ -24,6 +29,19 @@ LOCAL_FILE = "VTAPRODPRODUCTCLASSHISTORY.parquet"
 
 # MSSQL Table Configuration
 #TABLE_NAME = "RETAILTRANSACTIONSALESTRANS"
+TABLE_NAME = "VTAPRODPRODUCTCLASSHISTORY"
+QUERY = f"SELECT * FROM dbo.{TABLE_NAME} WITH (NOLOCK)"
+
+# "stream": fetch in chunks and upload row groups while fetching (flat memory), "dataframe": one pd.read_sql
+FETCH_MODE = os.getenv("DATALAKE_FETCH_MODE", "stream")
+CHUNK_SIZE = int(os.getenv("DATALAKE_CHUNK_SIZE", "100000"))
+UPLOAD_CHUNK_SIZE = 32 * 1024 * 1024  # Resumable upload chunk (multiple of 256 KB)
+
+# "full": snapshot of the whole table into LOCAL_FILE
+# "incremental": only rows changed since the last ingest, appended as parts of raw/TABLE/MODIFIEDDATETIME_month=YYYY-MM/
+INGEST_MODE = os.getenv("DATALAKE_INGEST_MODE", "full")
+DATASET_PATH = f"{GCS_FOLDER}{TABLE_NAME}/"
+LOOKBACK_MINUTES = int(os.getenv("DATALAKE_LOOKBACK_MINUTES", "0"))
 
 def get_sqlalchemy_engine():
     """Create an SQLAlchemy engine using pyodbc."""
@@ -51,9 +69,8 @@ def fetch_data():
         if not engine:
             return None
         
-        query = f"SELECT * FROM dbo.VTAPRODPRODUCTCLASSHISTORY WITH (NOLOCK)"
         with engine.connect() as conn:
-            df = pd.read_sql(query, con=conn)
+            df = pd.read_sql(QUERY, con=conn)
 
         if df.empty:
             print("⚠️ No data fetched from SQL Server.")
@@ -81,14 +98,81 @@ def upload_to_gcs(local_file, bucket_name, destination_blob):
     try:
         client = storage.Client()
         bucket = client.bucket(bucket_name)
-        blob = bucket.blob(destination_blob)
-        blob.upload_from_filename(local_file)
+        upload_to_bucket(bucket, local_file, destination_blob)  # Parallel composite upload for large files
         print(f"✅ File uploaded to gs://{bucket_name}/{destination_blob}")
     except Exception as e:
         print(f"❌ Error uploading to GCS: {e}")
 
+def upload_dataframe(df, bucket_name, destination_blob):
+    """Serialize a DataFrame to Parquet in memory and upload it, without writing a local file."""
+    try:
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        upload_to_bucket(storage.Client().bucket(bucket_name), buffer, destination_blob)
+        print(f"✅ Data uploaded to gs://{bucket_name}/{destination_blob} ({buffer.tell() / 1024:.2f} KB)")
+    except Exception as e:
+        print(f"❌ Error uploading to GCS: {e}")
+
+def stream_to_gcs(bucket_name, destination_blob):
+    """Fetch in chunks and write each one as a row group straight into a resumable GCS upload."""
+    try:
+        engine = get_sqlalchemy_engine()
+        if not engine:
+            return
+        schema = fetch_arrow_schema(engine, TABLE_NAME)
+        blob = storage.Client().bucket(bucket_name).blob(destination_blob)
+        f = blob.open("wb", chunk_size=UPLOAD_CHUNK_SIZE, ignore_flush=True, content_type="application/octet-stream")
+        try:
+            total_rows = stream_query_to_parquet(engine, QUERY, f, schema, chunk_size=CHUNK_SIZE)
+        except BaseException:
+            f.terminate()
+            raise
+        if total_rows == 0:
+            # Cancel the upload rather than replace the current snapshot with an empty file
+            f.terminate()
+            print(f"⚠️ No data fetched from SQL Server; gs://{bucket_name}/{destination_blob} left unchanged.")
+            return
+        f.close()
+        print(f"✅ Streamed {total_rows} rows to gs://{bucket_name}/{destination_blob}")
+    except SQLAlchemyError as e:
+        print(f"❌ SQLAlchemy Error fetching data: {e}")
+    except Exception as e:
+        print(f"❌ Error streaming to GCS: {e}")
+
+def stream_delta_to_dataset(bucket_name, dataset_path):
+    """Fetch the rows changed since the stored watermark and append them as new dataset parts."""
+    try:
+        engine = get_sqlalchemy_engine()
+        if not engine:
+            return
+        bucket = storage.Client().bucket(bucket_name)
+        watermark = load_watermark(bucket, TABLE_NAME)
+        where, params = incremental_filter(watermark, lookback_minutes=LOOKBACK_MINUTES)
+        tracker = WatermarkTracker(watermark)
+        schema = fetch_arrow_schema(engine, TABLE_NAME)
+
+        with PartitionedPartWriter(bucket, dataset_path, "MODIFIEDDATETIME", schema) as writer:
+            for chunk in iter_query_chunks(engine, f"{QUERY} {where}", chunk_size=CHUNK_SIZE, params=params):
+                writer.write(chunk)
+                tracker.update(chunk)
+
+        if not writer.entries:
+            print("⚠️ No changed rows since the last ingest.")
+            return
+        commit_manifest(bucket, dataset_path, writer.entries, "MODIFIEDDATETIME")
+        save_watermark(bucket, TABLE_NAME, tracker.watermark, tracker.rows)
+        print(f"✅ Appended {tracker.rows} changed rows to gs://{bucket_name}/{dataset_path}")
+    except SQLAlchemyError as e:
+        print(f"❌ SQLAlchemy Error fetching data: {e}")
+    except Exception as e:
+        print(f"❌ Error ingesting changed rows: {e}")
+
 if __name__ == "__main__":
-    df = fetch_data()
-    if df is not None:
-        save_to_parquet(df, LOCAL_FILE)
-        upload_to_gcs(LOCAL_FILE, BUCKET_NAME, f"{GCS_FOLDER}{LOCAL_FILE}")
+    if INGEST_MODE == "incremental":
+        stream_delta_to_dataset(BUCKET_NAME, DATASET_PATH)
+    elif FETCH_MODE == "stream":
+        stream_to_gcs(BUCKET_NAME, f"{GCS_FOLDER}{LOCAL_FILE}")
+    else:
+        df = fetch_data()
+        if df is not None:
+            upload_dataframe(df, BUCKET_NAME, f"{GCS_FOLDER}{LOCAL_FILE}")
@@ -0,0 +1,161 @@
+# Helpers shared by the data-lake scripts to move SQL Server (AX) tables into Parquet without holding a whole
+# table in memory: rows are fetched in chunks from a streaming cursor and each chunk is written as one row group
+# with a fixed Arrow schema derived from INFORMATION_SCHEMA.
+
+import logging
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+# Rows fetched per round trip and written per Parquet row group
+DEFAULT_CHUNK_SIZE = 100000
+
+SCHEMA_QUERY = """
+    SELECT COLUMN_NAME, DATA_TYPE
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA = :schema_name AND TABLE_NAME = :table_name
+    ORDER BY ORDINAL_POSITION
+"""
+
+# SQL Server type -> Arrow type. DECIMAL/NUMERIC/MONEY map to float64 because pd.read_sql coerces them to floats,
+# which is what the existing raw files (and the ClickHouse transform) expect.
+MSSQL_ARROW_TYPES = {
+    "bigint": pa.int64(),
+    "int": pa.int32(),
+    "smallint": pa.int16(),
+    "tinyint": pa.uint8(),
+    "bit": pa.bool_(),
+    "decimal": pa.float64(),
+    "numeric": pa.float64(),
+    "money": pa.float64(),
+    "smallmoney": pa.float64(),
+    "float": pa.float64(),
+    "real": pa.float32(),
+    "date": pa.date32(),
+    "datetime": pa.timestamp("us"),
+    "datetime2": pa.timestamp("us"),
+    "smalldatetime": pa.timestamp("us"),
+    "datetimeoffset": pa.timestamp("us", tz="UTC"),
+    "time": pa.time64("us"),
+    "char": pa.string(),
+    "nchar": pa.string(),
+    "varchar": pa.string(),
+    "nvarchar": pa.string(),
+    "text": pa.string(),
+    "ntext": pa.string(),
+    "uniqueidentifier": pa.string(),
+    "binary": pa.binary(),
+    "varbinary": pa.binary(),
+    "image": pa.binary(),
+    "timestamp": pa.binary(),  # rowversion
+}
+
+
+def fetch_arrow_schema(engine, table_name, schema_name="dbo"):
+    """Builds the fixed Arrow schema of a SQL Server table from INFORMATION_SCHEMA.COLUMNS."""
+    with engine.connect() as conn:
+        rows = conn.execute(text(SCHEMA_QUERY), {"schema_name": schema_name, "table_name": table_name}).fetchall()
+    if not rows:
+        raise ValueError(f"Table {schema_name}.{table_name} not found in INFORMATION_SCHEMA.")
+    return pa.schema([pa.field(name, MSSQL_ARROW_TYPES.get(data_type.lower(), pa.string())) for name, data_type in rows])
+
+
+def iter_query_chunks(engine, query, chunk_size=DEFAULT_CHUNK_SIZE, params=None):
+    """
+    Yields DataFrames of at most `chunk_size` rows. The connection is opened with stream_results, so rows are
+    pulled from the server as chunks are consumed instead of being buffered up front.
+    """
+    with engine.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql(text(query), con=conn, params=params, chunksize=chunk_size):
+            yield chunk
+
+
+def to_arrow(df, schema):
+    """Converts a chunk to the fixed schema, so every row group has the same types whatever values it holds."""
+    for field in schema:
+        # Drivers may hand back temporal values as strings (e.g. datetimeoffset, or an all-NULL chunk as object)
+        if pa.types.is_timestamp(field.type) and field.name in df.columns and df[field.name].dtype == object:
+            df[field.name] = pd.to_datetime(df[field.name], errors="coerce", utc=field.type.tz is not None)
+        # pyodbc returns TIME as datetime.time, older drivers as "hh:mm:ss.fffffff" strings
+        elif pa.types.is_time(field.type) and field.name in df.columns and df[field.name].dtype == object:
+            df[field.name] = df[field.name].map(lambda value: pd.Timestamp(value).time() if isinstance(value, str) else value)
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def stream_query_to_parquet(engine, query, sink, schema, chunk_size=DEFAULT_CHUNK_SIZE, params=None, compression="snappy"):
+    """
+    Runs `query` and writes its result to `sink` (a local path or a writable binary file, e.g. a GCS blob writer)
+    one row group per chunk. Memory stays bounded by the chunk size. Returns the number of rows written.
+    """
+    total_rows = 0
+    with pq.ParquetWriter(sink, schema, compression=compression) as writer:
+        for chunk in iter_query_chunks(engine, query, chunk_size=chunk_size, params=params):
+            writer.write_table(to_arrow(chunk, schema), row_group_size=chunk_size)
+            total_rows += len(chunk)
+            logging.info(f"Wrote chunk of {len(chunk)} rows ({total_rows} so far).")
+    return total_rows
+
+
+# ================================
+# Parallel range-partitioned extraction
+# ================================
+
+def get_range_bounds(engine, base_query, column, params=None):
+    """MIN/MAX of `column` over the rows selected by `base_query`."""
+    query = f"SELECT MIN({column}), MAX({column}) FROM ({base_query}) AS source"
+    with engine.connect() as conn:
+        return tuple(conn.execute(text(query), params or {}).fetchone())
+
+
+def split_ranges(low, high, num_ranges):
+    """Half-open [start, end) ranges of equal width covering [low, high], for integer keys (RECID), dates or datetimes."""
+    if low is None or high is None:
+        return []
+    if isinstance(low, (datetime, pd.Timestamp)):
+        edges = pd.date_range(pd.Timestamp(low), pd.Timestamp(high) + pd.Timedelta(seconds=1), periods=num_ranges + 1)
+        edges = [edge.to_pydatetime() for edge in edges]
+    elif isinstance(low, date):
+        # Whole days, split like integer keys so no two edges fall on the same date
+        return [(date.fromordinal(start), date.fromordinal(end)) for start, end in split_ranges(low.toordinal(), high.toordinal(), num_ranges)]
+    else:
+        low, high = int(low), int(high) + 1
+        step = max(1, -(-(high - low) // num_ranges))
+        edges = list(range(low, high, step)) + [high]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def range_query(base_query, column):
+    keyword = "AND" if " WHERE " in f" {base_query.upper()} " else "WHERE"
+    return f"{base_query} {keyword} {column} >= :range_start AND {column} < :range_end"
+
+
+def extract_ranges_parallel(engine, base_query, column, process_range, params=None, max_connections=4,
+                            ranges_per_connection=4, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Splits the key space of `column` into ranges and calls `process_range(index, chunks)` for each of them, where
+    `chunks` iterates the range's DataFrames. At most `max_connections` ranges are fetched at the same time, which
+    bounds the load put on the source server. There are more ranges than connections, so one dense range
+    (RECIDs are allocated in blocks) does not leave the other connections idle.
+    Returns the results of `process_range` in range order; the first failure cancels pending ranges and is raised.
+    """
+    low, high = get_range_bounds(engine, base_query, column, params)
+    ranges = split_ranges(low, high, max_connections * ranges_per_connection)
+    query = range_query(base_query, column)
+    logging.info(f"Extracting {column} in [{low}, {high}] as {len(ranges)} ranges over {max_connections} connections.")
+
+    def run(index, start, end):
+        range_params = {**(params or {}), "range_start": start, "range_end": end}
+        return process_range(index, iter_query_chunks(engine, query, chunk_size=chunk_size, params=range_params))
+
+    with ThreadPoolExecutor(max_workers=max_connections) as executor:
+        futures = [executor.submit(run, index, start, end) for index, (start, end) in enumerate(ranges)]
+        try:
+            return [future.result() for future in futures]
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
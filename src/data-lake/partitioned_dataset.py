@@ -0,0 +1,202 @@
+# Append-only, Hive-style partitioned Parquet datasets on GCS:
+#
+#   raw/RETAILTRANSACTIONSALESTRANS/_manifest.json
+#   raw/RETAILTRANSACTIONSALESTRANS/TRANSDATE_month=2025-01/part-20250201T020000-1a2b3c4d.parquet
+#
+# Every append uploads new part files only, then adds them to the manifest. Readers (etl/modules/gcs_handler.py)
+# only read parts listed in the manifest, so a failed append never exposes half-written data.
+
+import io
+import os
+import json
+import time
+import tempfile
+import uuid
+import logging
+from datetime import datetime, date
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from gcs_upload import upload_to_bucket
+
+MANIFEST_NAME = "_manifest.json"
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# Columns whose min/max are kept per part, so readers can skip parts without opening them
+STATS_COLUMNS = ("MODIFIEDDATETIME", "RECID")
+
+
+def partition_key(partition_column):
+    return f"{partition_column}_month"
+
+
+def manifest_path(dataset_path):
+    return f"{dataset_path.rstrip('/')}/{MANIFEST_NAME}"
+
+
+def _json_value(value):
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime, date)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _column_stats(df, columns):
+    stats = {}
+    for column in columns:
+        if column in df.columns and df[column].notna().any():
+            stats[column] = [_json_value(df[column].min()), _json_value(df[column].max())]
+    return stats
+
+
+def _partition_months(values):
+    return pd.to_datetime(values, errors="coerce").dt.strftime("%Y-%m").fillna(NULL_PARTITION)
+
+
+def _new_run_id():
+    return f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+def _part_path(dataset_path, partition_column, month, run_id):
+    return f"{dataset_path.rstrip('/')}/{partition_key(partition_column)}={month}/part-{run_id}.parquet"
+
+
+def _part_entry(blob_path, month, rows, nbytes, stats):
+    return {
+        "path": blob_path,
+        "partition": month,
+        "rows": rows,
+        "bytes": nbytes,
+        "created_at": datetime.utcnow().isoformat(),
+        "stats": stats,
+    }
+
+
+def write_partition_parts(df, bucket, dataset_path, partition_column, stats_columns=STATS_COLUMNS, compression="snappy"):
+    """
+    Uploads `df` as one new part file per month of `partition_column` and returns their manifest entries.
+    The manifest itself is not touched; call commit_manifest() once all parts are uploaded.
+    """
+    run_id = _new_run_id()
+    entries = []
+    for month, part_df in df.groupby(_partition_months(df[partition_column]), sort=True):
+        blob_path = _part_path(dataset_path, partition_column, month, run_id)
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(part_df, preserve_index=False), buffer, compression=compression)
+        upload_to_bucket(bucket, buffer, blob_path)
+
+        entries.append(_part_entry(blob_path, month, len(part_df), buffer.tell(), _column_stats(part_df, (partition_column, *stats_columns))))
+        logging.info(f"Uploaded part gs://{bucket.name}/{blob_path} ({len(part_df)} rows, {buffer.tell() / 1024:.2f} KB)")
+    return entries
+
+
+class PartitionedPartWriter:
+    """
+    Streaming counterpart of write_partition_parts: chunks are routed by month of `partition_column` to one
+    ParquetWriter per month (a local temporary file, one row group per chunk) with a fixed Arrow schema.
+    Parts are uploaded when the writer is closed; `entries` then holds their manifest entries.
+    On error nothing is uploaded.
+    """
+
+    def __init__(self, bucket, dataset_path, partition_column, schema, stats_columns=STATS_COLUMNS, compression="snappy"):
+        self.bucket = bucket
+        self.dataset_path = dataset_path
+        self.partition_column = partition_column
+        self.schema = schema
+        self.stats_columns = (partition_column, *stats_columns)
+        self.compression = compression
+        self.run_id = _new_run_id()
+        self.entries = []
+        self._parts = {}  # month -> {"path": local file, "writer": ParquetWriter, "rows": int, "stats": {col: [min, max]}}
+
+    def write(self, df):
+        for month, part_df in df.groupby(_partition_months(df[self.partition_column]), sort=True):
+            part = self._parts.get(month)
+            if part is None:
+                fd, local_path = tempfile.mkstemp(suffix=".parquet")
+                os.close(fd)
+                part = {"path": local_path, "writer": pq.ParquetWriter(local_path, self.schema, compression=self.compression), "rows": 0, "stats": {}}
+                self._parts[month] = part
+
+            part["writer"].write_table(pa.Table.from_pandas(part_df, schema=self.schema, preserve_index=False))
+            part["rows"] += len(part_df)
+            for column in self.stats_columns:
+                if column in part_df.columns and part_df[column].notna().any():
+                    chunk_min, chunk_max = part_df[column].min(), part_df[column].max()
+                    current = part["stats"].get(column)
+                    part["stats"][column] = [chunk_min, chunk_max] if current is None else [min(current[0], chunk_min), max(current[1], chunk_max)]
+
+    def close(self, upload=True):
+        try:
+            for month, part in sorted(self._parts.items()):
+                part["writer"].close()
+                if not upload:
+                    continue
+                blob_path = _part_path(self.dataset_path, self.partition_column, month, self.run_id)
+                upload_to_bucket(self.bucket, part["path"], blob_path)
+                nbytes = os.path.getsize(part["path"])
+                stats = {column: [_json_value(value) for value in values] for column, values in part["stats"].items()}
+                self.entries.append(_part_entry(blob_path, month, part["rows"], nbytes, stats))
+                logging.info(f"Uploaded part gs://{self.bucket.name}/{blob_path} ({part['rows']} rows, {nbytes / 1024:.2f} KB)")
+        finally:
+            for part in self._parts.values():
+                os.remove(part["path"])
+            self._parts = {}
+        return self.entries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(upload=exc_type is None)
+
+
+def load_manifest(bucket, dataset_path):
+    """Returns (manifest, generation); generation is 0 when the dataset has no manifest yet."""
+    blob = bucket.blob(manifest_path(dataset_path))
+    try:
+        blob.reload()
+        return json.loads(blob.download_as_bytes(if_generation_match=blob.generation)), blob.generation
+    except NotFound:
+        return None, 0
+
+
+def commit_manifest(bucket, dataset_path, entries, partition_column, retries=5):
+    """
+    Adds part entries to the dataset manifest. The write is conditional on the manifest generation that was read,
+    so concurrent appends retry instead of overwriting each other's entries.
+    """
+    for attempt in range(1, retries + 1):
+        manifest, generation = load_manifest(bucket, dataset_path)
+        manifest = manifest or {
+            "format": "parquet",
+            "partition_column": partition_column,
+            "partition_key": partition_key(partition_column),
+            "parts": [],
+        }
+        manifest["parts"].extend(entries)
+        manifest["updated_at"] = datetime.utcnow().isoformat()
+        try:
+            bucket.blob(manifest_path(dataset_path)).upload_from_string(
+                json.dumps(manifest, indent=2), content_type="application/json", if_generation_match=generation
+            )
+            logging.info(f"Manifest gs://{bucket.name}/{manifest_path(dataset_path)} now lists {len(manifest['parts'])} parts.")
+            return manifest
+        except PreconditionFailed:
+            logging.warning(f"Manifest changed concurrently, retrying ({attempt}/{retries})...")
+            time.sleep(attempt)
+    raise RuntimeError(f"Could not update manifest of {dataset_path} after {retries} attempts.")
+
+
+def append_partitioned(df, bucket, dataset_path, partition_column, stats_columns=STATS_COLUMNS):
+    """Appends a DataFrame to a partitioned dataset: cost is proportional to the new rows, not to the history."""
+    entries = write_partition_parts(df, bucket, dataset_path, partition_column, stats_columns=stats_columns)
+    if entries:
+        commit_manifest(bucket, dataset_path, entries, partition_column)
+    return entries
@@ -0,0 +1,461 @@
+import os
+import sys
+import io
+import re
+import json
+import time
+import shutil
+import argparse
+import logging
+import tempfile
+import threading
+import statistics
+from datetime import datetime, timezone
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+parent_path = os.path.dirname(current_path)
+sql_folder_path = os.path.join(os.path.dirname(parent_path), "clickhouse", "prod_source")
+sys.path.append(parent_path)
+
+import psutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# End-to-end benchmark of the table ETL job without GCS or ClickHouse Cloud:
+#   - generates Parquet files shaped like the production tables (columns parsed from src/clickhouse/prod_source DDL),
+#   - serves them through a filesystem-backed stand-in for the GCS client used by gcs_handler,
+#   - loads into a recording fake ClickHouse client that answers metadata queries and counts inserted rows/bytes,
+# and reports wall time, rows/s, bytes and peak RSS per stage. Compare against a saved baseline to catch regressions:
+#
+#   python benchmark_pipeline.py --tables custinvoicejour salesline --rows 10000 1000000 --save-baseline baseline.json
+#   python benchmark_pipeline.py --tables custinvoicejour salesline --rows 10000 1000000 --baseline baseline.json
+
+DATABASE_NAME = "prod_source"
+BENCH_TABLES = ("custinvoicejour", "salesline")
+STAGES = ("extract", "transform", "load")
+
+# Columns ClickHouse fills itself; they are not part of the source files
+TARGET_ONLY_COLUMNS = ("last_synced_at", "updated_at")
+
+COLUMN_PATTERN = re.compile(r"^\s*(\w+)\s+(.+?)(?:\s+DEFAULT\s+(.+?))?\s*,?\s*$")
+
+
+# ================================
+# 1. Table shapes and data generation
+# ================================
+
+def load_table_columns(table_name):
+    """Returns [(name, type, default_kind, default_expression)] parsed from the table's CREATE TABLE file."""
+    with open(os.path.join(sql_folder_path, f"create_src_{table_name}_table.sql"), "r") as f:
+        lines = f.read().split("(", 1)[1].splitlines()
+
+    columns = []
+    for line in lines:
+        if line.strip().startswith(")"):
+            break
+        match = COLUMN_PATTERN.match(line)
+        if not match or match.group(1).upper() == "PRIMARY":
+            continue
+        name, col_type, default = match.groups()
+        columns.append((name, col_type, "DEFAULT" if default else "", default or ""))
+    return columns
+
+
+def _generate_column(name, col_type, rows, rng, start, end):
+    nullable = col_type.startswith("Nullable(")
+    base = col_type[len("Nullable("):-1] if nullable else col_type
+
+    if name == "RECID":
+        values = np.arange(5000000000, 5000000000 + rows, dtype="int64")
+    elif name == "MODIFIEDDATETIME":
+        # Mostly increasing with the RECID, as in the source system, so row-group statistics are selective
+        offsets = np.linspace(0, (end - start).total_seconds(), rows) + rng.normal(0, 3600, rows)
+        values = (start + pd.to_timedelta(np.clip(offsets, 0, None), unit="s")).floor("s").values
+    elif base.startswith("DateTime") or base.startswith("Date"):
+        values = (start + pd.to_timedelta(rng.integers(0, int((end - start).total_seconds()), rows), unit="s")).values
+    elif base.startswith("Int") or base.startswith("UInt"):
+        values = rng.integers(0, 1000000, rows, dtype="int64")
+    elif base.startswith("Float") or base.startswith("Decimal"):
+        values = np.round(rng.random(rows) * 1000000, 4)
+    else:
+        # Low-cardinality codes, like most String columns of the source tables
+        pool = np.array([f"{name[:6]}-{i:05d}" for i in range(1000)], dtype=object)
+        values = pool[rng.integers(0, len(pool), rows)]
+
+    if nullable:
+        values = pd.Series(values)
+        values[rng.random(rows) < 0.2] = None
+    return pa.array(values)
+
+
+def generate_parquet_file(table_name, rows, path, seed=42, row_group_size=100000):
+    """Writes `rows` synthetic records with the table's source columns to a Parquet file."""
+    rng = np.random.default_rng(seed)
+    start, end = pd.Timestamp("2023-01-01"), pd.Timestamp("2025-01-01")
+    columns = [col for col in load_table_columns(table_name) if col[0] not in TARGET_ONLY_COLUMNS]
+    arrays = [_generate_column(name, col_type, rows, rng, start, end) for name, col_type, _, _ in columns]
+    table = pa.Table.from_arrays(arrays, names=[col[0] for col in columns])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path, row_group_size=row_group_size)
+    return os.path.getsize(path)
+
+
+# ================================
+# 2. Local GCS stand-in
+# ================================
+
+class CountingFile(io.FileIO):
+    """Binary file that counts the bytes actually read, i.e. what would be downloaded from GCS."""
+
+    def __init__(self, path, counter):
+        super().__init__(path, "r")
+        self._counter = counter
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self._counter["bytes_read"] += len(data)
+        return data
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        self._counter["bytes_read"] += count or 0
+        return count
+
+
+class LocalBlob:
+    def __init__(self, root, name, counter):
+        self.name = name
+        self._path = os.path.join(root, name)
+        self._counter = counter
+        self.reload()
+
+    def reload(self):
+        if os.path.exists(self._path):
+            stat = os.stat(self._path)
+            self.size = stat.st_size
+            self.generation = stat.st_mtime_ns
+            self.updated = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+        else:
+            self.size, self.generation, self.updated = None, None, None
+        self.crc32c = None  # Not computed locally; gcs_handler skips verification
+        self.md5_hash = None
+
+    def download_as_bytes(self, start=None, end=None, **kwargs):
+        with CountingFile(self._path, self._counter) as f:
+            f.seek(start or 0)
+            return f.read() if end is None else f.read(end - (start or 0) + 1)
+
+    def open(self, mode="r", chunk_size=None, **kwargs):
+        if "b" in mode:
+            return CountingFile(self._path, self._counter)
+        return open(self._path, mode)
+
+
+class LocalBucket:
+    def __init__(self, root, name, counter):
+        self.name = name
+        self._root = os.path.join(root, name)
+        self._counter = counter
+
+    def blob(self, name):
+        return LocalBlob(self._root, name, self._counter)
+
+    def list_blobs(self, prefix="", match_glob=None):
+        # Only the "{name,name,...}" globs built by gcs_handler.get_files_metadata are supported
+        names = match_glob.strip("{}").split(",") if match_glob else []
+        return [self.blob(name) for name in names if name.startswith(prefix) and os.path.isfile(os.path.join(self._root, name))]
+
+
+class LocalGCSClient:
+    """Filesystem-backed replacement for google.cloud.storage.Client: gs://bucket/path -> root/bucket/path."""
+
+    def __init__(self, root):
+        self.root = root
+        self.counter = {"bytes_read": 0}
+
+    def bucket(self, name):
+        return LocalBucket(self.root, name, self.counter)
+
+
+# ================================
+# 3. Recording ClickHouse stand-in
+# ================================
+
+class FakeQueryResult:
+    def __init__(self, rows):
+        self.result_rows = rows
+        self.result_set = rows
+
+
+class RecordingClickHouseClient:
+    """
+    Fake clickhouse_connect client: answers the metadata queries the pipeline issues from the DDL files and
+    records inserts (rows and payload bytes) instead of sending them.
+    """
+
+    def __init__(self, database_name, tables):
+        self.database_name = database_name
+        self.columns = {table: load_table_columns(table) for table in tables}
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.inserted_rows = 0
+        self.inserted_bytes = 0
+        self.queries = []
+
+    def _record_insert(self, rows, nbytes):
+        with self.lock:
+            self.inserted_rows += rows
+            self.inserted_bytes += nbytes
+
+    def query(self, query, parameters=None, **kwargs):
+        if query.lstrip().startswith("INSERT") and " VALUES " in query:
+            # "values" load mode: one "(...),\n(...)" row per line after VALUES
+            payload = query.split(" VALUES ", 1)[1].strip().rstrip(";").encode()
+            self._record_insert(payload.count(b"\n") + 1 if payload else 0, len(payload))
+            return FakeQueryResult([])
+        with self.lock:
+            self.queries.append(query)
+        if "SHOW DATABASES" in query:
+            return FakeQueryResult([(self.database_name,)])
+        if "cityHash64" in query:
+            return FakeQueryResult([("benchmark",)])
+        if "system.columns" in query:
+            tables = parameters.get("tables", ()) if parameters else ()
+            return FakeQueryResult([(table, *col) for table in tables for col in self.columns.get(table, [])])
+        return FakeQueryResult([])
+
+    def command(self, cmd, parameters=None, **kwargs):
+        with self.lock:
+            self.queries.append(cmd)
+
+    def insert(self, table, data=None, column_names=None, database=None, **kwargs):
+        self._record_insert(len(data or []), 0)
+
+    def insert_df(self, table=None, df=None, database=None, **kwargs):
+        self._record_insert(len(df), int(df.memory_usage(index=False, deep=True).sum()))
+
+    def insert_arrow(self, table, arrow_table, database=None, **kwargs):
+        self._record_insert(arrow_table.num_rows, arrow_table.nbytes)
+
+    def raw_insert(self, table, column_names=None, insert_block=None, fmt=None, **kwargs):
+        blocks = [insert_block] if isinstance(insert_block, (str, bytes)) else insert_block
+        nbytes = rows = 0
+        for block in blocks:
+            block = block.encode() if isinstance(block, str) else block
+            nbytes += len(block)
+            rows += block.count(b"\n")
+        self._record_insert(rows, nbytes)
+
+    def ping(self):
+        return True
+
+    def close(self):
+        pass
+
+
+# ================================
+# 4. Measurement
+# ================================
+
+class PeakRSSSampler:
+    """Samples the process RSS in a background thread while the block runs."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def measure(func, *args):
+    with PeakRSSSampler() as sampler:
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+    return result, seconds, sampler.peak / 1024 / 1024
+
+
+def run_once(modules, table_name, load_mode, gcs_client, ch_client, watermark, logger):
+    """Runs extract, transform and load of one table job; returns per-stage metrics."""
+    table_job, watermark_store, metadata_cache, db_connector = modules
+    metadata_cache.invalidate_metadata()
+    db_connector.close_all_connections()
+    if os.path.exists(watermark_store.LOCAL_STATE_FILE):
+        os.remove(watermark_store.LOCAL_STATE_FILE)
+    if watermark is not None:
+        watermark_store.set_watermark(DATABASE_NAME, table_name, watermark, job_name="benchmark")
+
+    gcs_client.counter["bytes_read"] = 0
+    ch_client.reset()
+    job = table_job.TableETLJob(table_name, database_name=DATABASE_NAME, mode="daily", load_mode=load_mode)
+
+    data, extract_seconds, extract_rss = measure(job.extract, logger)
+    rows = 0 if data is None else len(data)
+    stages = {"extract": {"seconds": extract_seconds, "rows": rows, "bytes": gcs_client.counter["bytes_read"], "peak_rss_mb": extract_rss}}
+    if rows:
+        transformed, seconds, rss = measure(job.transform, data, logger)
+        stages["transform"] = {"seconds": seconds, "rows": len(transformed), "bytes": int(transformed.memory_usage(index=False, deep=True).sum()), "peak_rss_mb": rss}
+        del data
+        _, seconds, rss = measure(job.load, transformed, logger)
+        stages["load"] = {"seconds": seconds, "rows": ch_client.inserted_rows, "bytes": ch_client.inserted_bytes, "peak_rss_mb": rss}
+
+    for metrics in stages.values():
+        metrics["rows_per_sec"] = metrics["rows"] / metrics["seconds"] if metrics["seconds"] else 0.0
+    return stages
+
+
+def median_stages(runs):
+    """Median of every metric across repeated runs of the same case."""
+    merged = {}
+    for stage in STAGES:
+        samples = [run[stage] for run in runs if stage in run]
+        if samples:
+            merged[stage] = {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+    return merged
+
+
+# ================================
+# 5. Baseline comparison and reporting
+# ================================
+
+def case_key(case):
+    return f"{case['table']}:{case['rows']}:{case['load_mode']}:{case['incremental']}"
+
+
+def compare_with_baseline(cases, baseline, tolerance):
+    """Returns a list of regression messages: stages slower, or using more memory, than baseline * (1 + tolerance)."""
+    baseline_cases = {case_key(case): case for case in baseline.get("cases", [])}
+    regressions = []
+    for case in cases:
+        reference = baseline_cases.get(case_key(case))
+        if not reference:
+            continue
+        for stage, metrics in case["stages"].items():
+            ref = reference["stages"].get(stage)
+            if not ref:
+                continue
+            for metric in ("seconds", "peak_rss_mb"):
+                if ref[metric] and metrics[metric] > ref[metric] * (1 + tolerance):
+                    regressions.append(f"{case_key(case)} {stage} {metric}: {metrics[metric]:.2f} vs baseline {ref[metric]:.2f} "
+                                       f"(+{(metrics[metric] / ref[metric] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def print_report(cases):
+    header = f"{'table':<18}{'rows':>10}  {'stage':<10}{'seconds':>9}{'rows/s':>13}{'MB':>10}{'peak RSS MB':>13}"
+    print(header)
+    print("-" * len(header))
+    for case in cases:
+        for stage, metrics in case["stages"].items():
+            print(f"{case['table']:<18}{case['rows']:>10}  {stage:<10}{metrics['seconds']:>9.3f}{metrics['rows_per_sec']:>13,.0f}"
+                  f"{metrics['bytes'] / 1024 / 1024:>10.1f}{metrics['peak_rss_mb']:>13.1f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the table ETL job against local GCS and ClickHouse stand-ins.")
+    parser.add_argument("--tables", nargs="+", choices=BENCH_TABLES, default=["custinvoicejour"], help="Table shapes to benchmark.")
+    parser.add_argument("--rows", nargs="+", type=int, default=[10000, 100000], help="Source file sizes in rows.")
+    parser.add_argument("--load-mode", default="native", choices=("native", "arrow", "tsv", "values"), help="ClickHouse insert format.")
+    parser.add_argument("--incremental", type=float, default=0.0,
+                        help="Fraction of the file already synced (watermark placed at this quantile of MODIFIEDDATETIME).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the median is reported.")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "etl_benchmark_data"),
+                        help="Where generated Parquet files are kept between benchmark runs.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--save-baseline", help="Write the results as the new baseline JSON.")
+    parser.add_argument("--baseline", help="Baseline JSON to compare with; exits with status 1 on regression.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown / memory growth over the baseline.")
+    parser.add_argument("--cache", action="store_true",
+                        help="Enable the local GCS file cache (repeated runs then read the generated files from it).")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own log messages.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+    logger = logging.getLogger("benchmark_pipeline")
+
+    # Isolate the run: local watermark state, no merges against a real server
+    state_dir = tempfile.mkdtemp(prefix="etl_benchmark_state_")
+    os.environ["ETL_WATERMARK_BACKEND"] = "local"
+    os.environ["ETL_WATERMARK_STATE_FILE"] = os.path.join(state_dir, "watermarks.json")
+    os.environ["ETL_MERGE_MODE"] = "off"
+    os.environ["CLICKHOUSE_METADATA_CACHE_FILE"] = ""
+    os.environ["GCS_CACHE_DIR"] = os.path.join(state_dir, "gcs_cache")
+    if not args.cache:
+        os.environ["GCS_CACHE_MAX_BYTES"] = "0"
+
+    from modules import db_connector, gcs_handler, metadata_cache, table_job, watermark_store
+
+    gcs_client = LocalGCSClient(args.data_dir)
+    ch_client = RecordingClickHouseClient(DATABASE_NAME, args.tables)
+    gcs_handler.get_gcs_client = lambda: gcs_client
+    db_connector._create_client = lambda db_name: ch_client
+    modules = (table_job, watermark_store, metadata_cache, db_connector)
+
+    storage = table_job.load_storage_config()["gcs"]
+    cases = []
+    try:
+        for table_name in args.tables:
+            for rows in args.rows:
+                # Generated files are reused between benchmark runs; the source path rotates per size
+                storage["files"][table_name] = f"benchmark/{table_name.upper()}_{rows}.parquet"
+                path = os.path.join(args.data_dir, storage["bucket_name"], storage["files"][table_name])
+                if not os.path.exists(path):
+                    print(f"Generating {rows} {table_name} rows...")
+                    generate_parquet_file(table_name, rows, path)
+                table_job.load_storage_config = lambda storage=storage: {"gcs": storage}
+
+                watermark = None
+                if args.incremental > 0:
+                    modified = pq.read_table(path, columns=["MODIFIEDDATETIME"]).column(0).to_pandas()
+                    watermark = modified.quantile(args.incremental)
+
+                runs = [run_once(modules, table_name, args.load_mode, gcs_client, ch_client, watermark, logger) for _ in range(args.repeat)]
+                cases.append({"table": table_name, "rows": rows, "load_mode": args.load_mode, "incremental": args.incremental,
+                              "file_bytes": os.path.getsize(path), "stages": median_stages(runs)})
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    print_report(cases)
+    result = {"created_at": pd.Timestamp.now().isoformat(), "python": sys.version.split()[0],
+              "pandas": pd.__version__, "pyarrow": pa.__version__, "cases": cases}
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2, default=str)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare_with_baseline(cases, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,29 +7,36 @@ sys.path.append(current_path)
 import time
 import psutil
 import logging
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from logs.etl_metrics import PIPELINE_STAGE, start_run, record_stage, finish_run
+from logs.etl_tracing import span, start_trace, finish_trace
+from logs.etl_profiling import profile_stage
 
 # ================================
 # 1. Setup Logger
 # ================================
 
 def setup_logger(job_name):
-    """Sets up a logger for the ETL job, saving logs per job_name."""
+    """
+    Sets up a logger for the ETL job, saving logs per job_name. The file handler is attached to the job's own
+    logger rather than the root logger, so jobs running as threads of one process keep writing to their own file.
+    """
     log_filename = f"{current_path}/log_ETL_{job_name}.log"
 
     logger = logging.getLogger(job_name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
 
-    if logger.hasHandlers():
-        logger.handlers.clear()
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        handler.close()
 
-    logging.basicConfig(
-        filename=log_filename,
-        encoding="utf-8",
-        level=logging.DEBUG,
-        format="%(asctime)s [%(levelname)s] %(message)s",
-        force=True
-    )
+    file_handler = logging.FileHandler(log_filename, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+    logger.addHandler(file_handler)
 
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
@@ -60,46 +67,118 @@ def cleanup_logs(log_dir="logs", days_to_keep=30):
 
 
 # ================================
-# 3. Performance Tracking Decorator (with error handling)
+# 3. Resource Sampling
+# ================================
+
+# Seconds between two samples of the process taken by ResourceSampler
+SAMPLE_INTERVAL = float(os.getenv("ETL_SAMPLE_INTERVAL", "0.2"))
+
+
+class ResourceSampler:
+    """
+    Measures the current process while a block runs, without blocking it:
+    - CPU time (user/sys) and I/O bytes as differences of psutil's cumulative counters, so they are exact;
+    - peak RSS and peak thread count sampled every `interval` seconds on a daemon thread, so short peaks
+      between the start and end of a stage are not missed.
+
+    Counters are process-wide: stages running concurrently in the same process (threads) are counted together.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.metrics = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _io_counters(self):
+        try:
+            return self.process.io_counters()
+        except (AttributeError, psutil.AccessDenied):  # Not available on every platform
+            return None
+
+    def _sample(self):
+        rss = self.process.memory_info().rss
+        threads = self.process.num_threads()
+        self._peak_rss = max(self._peak_rss, rss)
+        self._peak_threads = max(self._peak_threads, threads)
+        return rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._peak_rss, self._peak_threads = 0, 0
+        self._start_rss = self._sample()
+        self._start_cpu = self.process.cpu_times()
+        self._start_io = self._io_counters()
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="ResourceSampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        duration = time.perf_counter() - self._start_time
+        end_rss = self._sample()
+        end_cpu = self.process.cpu_times()
+        end_io = self._io_counters()
+
+        cpu_user = end_cpu.user - self._start_cpu.user
+        cpu_system = end_cpu.system - self._start_cpu.system
+        self.metrics = {
+            "duration_seconds": duration,
+            "cpu_user_seconds": cpu_user,
+            "cpu_system_seconds": cpu_system,
+            # Share of one core; above 100% when several threads compute in parallel
+            "cpu_percent": (cpu_user + cpu_system) / duration * 100 if duration else 0.0,
+            "rss_start_mb": self._start_rss / 1024 / 1024,
+            "rss_end_mb": end_rss / 1024 / 1024,
+            "peak_rss_mb": self._peak_rss / 1024 / 1024,
+            "read_bytes": end_io.read_bytes - self._start_io.read_bytes if end_io and self._start_io else None,
+            "write_bytes": end_io.write_bytes - self._start_io.write_bytes if end_io and self._start_io else None,
+            "peak_threads": self._peak_threads,
+        }
+
+    def summary(self):
+        m = self.metrics
+        text = (
+            f"{m['duration_seconds']:.2f} seconds, CPU {m['cpu_user_seconds']:.2f}s user / {m['cpu_system_seconds']:.2f}s sys "
+            f"({m['cpu_percent']:.0f}%), peak RSS {m['peak_rss_mb']:.2f} MB (memory delta {m['rss_end_mb'] - m['rss_start_mb']:+.2f} MB)"
+        )
+        if m["read_bytes"] is not None:
+            text += f", I/O read {m['read_bytes'] / 1024 / 1024:.2f} MB / write {m['write_bytes'] / 1024 / 1024:.2f} MB"
+        return f"{text}, peak threads {m['peak_threads']}"
+
+
+# ================================
+# 4. Performance Tracking Decorator (with error handling)
 # ================================
 
 def track_performance(stage_name, retries=3, backoff=2):
     """
-    Decorator to track time, memory, and CPU usage of ETL stages,
-    with error handling and retries.
+    Decorator to track time, memory, CPU and I/O of ETL stages (see ResourceSampler),
+    with error handling and retries. Measurements are also added to the job's run metrics (etl_metrics.py).
+    Set ETL_PROFILE to also profile the stage (see etl_profiling.py).
     """
     def decorator(func):
         def wrapper(*args, **kwargs):
             logger = args[-1]  # Assumes last argument is the logger
 
-            # Track time, memory, and CPU at the start
-            process = psutil.Process()
-            start_memory = process.memory_info().rss / 1024 / 1024
-            start_cpu = psutil.cpu_percent(interval=None)
-            start_time = time.time()
-
             logger.info(f"Starting {stage_name}")
 
-            # Retry logic
+            # Retry logic: only the ETL function is retried, never the bookkeeping after it succeeded
             attempts = 0
-            while attempts < retries:
+            while True:
+                sampler = ResourceSampler()
                 try:
-                    # Run the ETL function
-                    result = func(*args, **kwargs)
-
-                    # Track performance metrics after the function
-                    end_memory = process.memory_info().rss / 1024 / 1024
-                    end_cpu = psutil.cpu_percent(interval=None)
-                    duration = time.time() - start_time
-                    memory_used = end_memory - start_memory
-                    cpu_used = end_cpu - start_cpu
-
-                    # Log the performance metrics
-                    logger.info(
-                        f"Completed {stage_name} in {duration:.2f} seconds, "
-                        f"memory used: {memory_used:.2f} MB, CPU used: {cpu_used:.2f}%"
-                    )
-                    return result
+                    # Run the ETL function; retries and their backoff are not part of the measurement
+                    with sampler, span(f"stage.{stage_name}", attempt=attempts + 1), \
+                            profile_stage(logger.name, stage_name, logger):
+                        result = func(*args, **kwargs)
+                    break
 
                 except Exception as e:
                     attempts += 1
@@ -113,53 +192,135 @@ def track_performance(stage_name, retries=3, backoff=2):
                         time.sleep(backoff ** attempts)
                     else:
                         logger.critical(f"Failed {stage_name} after {retries} attempts.")
+                        record_stage(logger.name, stage_name, sampler.metrics, status="failed", retries=attempts - 1)
                         raise
 
+            logger.info(f"Completed {stage_name} in {sampler.summary()}")
+            data_in = next((arg for arg in args if hasattr(arg, "shape")), None)
+            record_stage(logger.name, stage_name, sampler.metrics, retries=attempts, data_in=data_in, data_out=result)
+            return result
+
         return wrapper
 
     return decorator
 
 
 # ================================
-# 4. ETL Pipeline Runner (With Error Recovery)
+# 5. ETL Pipeline Runner (With Error Recovery)
 # ================================
 
 def run_etl_pipeline(job_name, extract, transform, load):
-    """Runs the ETL pipeline with logging, performance tracking, and error handling."""
+    """Runs the ETL pipeline with logging, performance tracking, and error handling. Returns True on success."""
     logger = setup_logger(job_name)
     logger.info(f"ETL Pipeline started for job: {job_name}")
 
     # Clean up old logs first
     cleanup_logs()
 
+    start_run(job_name)
+    start_trace(job_name)
+    sampler = ResourceSampler()
     try:
-        # Track total pipeline performance (CPU, memory, time)
-        pipeline_start_time = time.time()
-        process = psutil.Process()
-        pipeline_start_memory = process.memory_info().rss / 1024 / 1024
-
-        # Start CPU tracking using a time interval
-        psutil.cpu_percent(interval=None)  # Reset CPU tracking
-        time.sleep(1)  # Small delay to get more accurate CPU reading
-        cpu_start = psutil.cpu_percent(interval=1, percpu=False)  
-
-        # Run ETL steps
-        data = extract(logger)
-        if data is not None and not data.empty:
-            transformed_data = transform(data, logger)
-            if transformed_data is not None and not transformed_data.empty:
-                load(transformed_data, logger)
-
-        # Capture total performance stats
-        total_duration = time.time() - pipeline_start_time
-        total_memory_used = (process.memory_info().rss / 1024 / 1024) - pipeline_start_memory
-        cpu_end = psutil.cpu_percent(interval=1, percpu=False)  # Capture CPU after pipeline
-        total_cpu_used = (cpu_start + cpu_end) / 2  # Take the average CPU usage
+        # Track total pipeline performance (CPU, memory, I/O, time) in the background
+        rows = 0
+        with sampler, span("pipeline", job_name=job_name), profile_stage(job_name, PIPELINE_STAGE, logger):
+            # Run ETL steps
+            data = extract(logger)
+            if data is not None and not data.empty:
+                rows = len(data)
+                transformed_data = transform(data, logger)
+                if transformed_data is not None and not transformed_data.empty:
+                    load(transformed_data, logger)
+
+        logger.info(f"ETL Pipeline completed for job: {job_name} in {sampler.summary()}")
+        finish_run(job_name, "success", sampler.metrics, logger, rows=rows, batches=1 if rows else 0)
+        return True
+
+    except Exception as e:
+        logger.critical(f"ETL Pipeline failed for job: {job_name} — Error: {e}", exc_info=True)
+        finish_run(job_name, "failed", sampler.metrics, logger)
+        return False
+    finally:
+        finish_trace(job_name, logger)
+
+
+# ================================
+# 6. Streaming ETL Pipeline Runner (bounded memory)
+# ================================
+
+def run_streaming_etl_pipeline(job_name, extract_batches, transform, load, finalize=None, max_in_flight_batches=2):
+    """
+    Runs the ETL pipeline batch by batch: `extract_batches(logger)` yields DataFrames, each batch is
+    transformed and loaded independently, and `finalize(logger)` runs once after every batch is loaded.
+
+    At most `max_in_flight_batches` batches are extracted but not yet loaded at any time; the extract
+    generator is not advanced until a slot frees up, so memory stays bounded by the batch size.
+    """
+    logger = setup_logger(job_name)
+    logger.info(f"Streaming ETL Pipeline started for job: {job_name} (max {max_in_flight_batches} batches in flight)")
+
+    # Clean up old logs first
+    cleanup_logs()
+
+    start_run(job_name)
+    start_trace(job_name)
+    sampler = ResourceSampler()
+    try:
+        # Track total pipeline performance (CPU, memory, I/O, time) in the background
+        with sampler, span("pipeline", job_name=job_name, streaming=True), profile_stage(job_name, PIPELINE_STAGE, logger):
+            in_flight = threading.BoundedSemaphore(max_in_flight_batches)
+            failed = threading.Event()
+            futures = []
+            total_rows = 0
+
+            def process_batch(batch_num, batch):
+                try:
+                    with span("stream.batch", batch=batch_num, rows=len(batch)):
+                        transformed_batch = transform(batch, logger)
+                        if transformed_batch is not None and not transformed_batch.empty:
+                            load(transformed_batch, logger)
+                    logger.info(f"Batch {batch_num}: {len(batch)} records processed.")
+                except Exception:
+                    failed.set()
+                    raise
+                finally:
+                    in_flight.release()
+
+            batches = iter(extract_batches(logger))
+            with ThreadPoolExecutor(max_workers=max_in_flight_batches) as executor:
+                batch_num = 0
+                while not failed.is_set():
+                    in_flight.acquire()  # Wait for a free slot before pulling the next batch
+                    batch = next(batches, None)
+                    if batch is None:
+                        in_flight.release()
+                        break
+                    if batch.empty:
+                        in_flight.release()
+                        continue
+
+                    batch_num += 1
+                    total_rows += len(batch)
+                    futures.append(executor.submit(process_batch, batch_num, batch))
+                    del batch
+
+            # Re-raise the first batch failure, if any
+            for future in futures:
+                future.result()
+
+            if finalize and futures:
+                finalize(logger)
 
         logger.info(
-            f"ETL Pipeline completed for job: {job_name} in {total_duration:.2f} seconds, "
-            f"total memory used: {total_memory_used:.2f} MB, total CPU used: {total_cpu_used:.2f}%"
+            f"Streaming ETL Pipeline completed for job: {job_name}: "
+            f"{total_rows} records in {len(futures)} batches in {sampler.summary()}"
         )
+        finish_run(job_name, "success", sampler.metrics, logger, rows=total_rows, batches=len(futures))
+        return True
 
     except Exception as e:
-        logger.critical(f"ETL Pipeline failed for job: {job_name} — Error: {e}", exc_info=True)
\ No newline at end of file
+        logger.critical(f"Streaming ETL Pipeline failed for job: {job_name} — Error: {e}", exc_info=True)
+        finish_run(job_name, "failed", sampler.metrics, logger)
+        return False
+    finally:
+        finish_trace(job_name, logger)
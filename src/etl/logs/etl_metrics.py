@@ -0,0 +1,294 @@
+import os
+import sys
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(current_path)
+
+import json
+import time
+import uuid
+import logging
+import argparse
+import statistics
+import threading
+from datetime import datetime
+
+# Structured per-run, per-stage metrics of the ETL jobs:
+# - appended to a JSONL history (one record per stage of every run, plus a "Pipeline" record for the whole run);
+# - written as a Prometheus textfile per job, for node_exporter's textfile collector;
+# - compared with the rolling baseline of the same job, so a stage that suddenly gets slower or heavier is flagged.
+
+METRICS_DIR = os.getenv("ETL_METRICS_DIR", os.path.join(os.path.dirname(current_path), 'state', 'metrics'))
+METRICS_HISTORY_FILE = os.getenv("ETL_METRICS_HISTORY_FILE", os.path.join(METRICS_DIR, 'etl_metrics.jsonl'))
+PROMETHEUS_TEXTFILE_DIR = os.getenv("ETL_PROMETHEUS_TEXTFILE_DIR", os.path.join(METRICS_DIR, 'prometheus'))
+
+# Regression detection: a stage is compared with the median of its last BASELINE_RUNS successful runs
+BASELINE_RUNS = int(os.getenv("ETL_BASELINE_RUNS", "10"))
+MIN_BASELINE_RUNS = 3
+REGRESSION_TOLERANCE = float(os.getenv("ETL_REGRESSION_TOLERANCE", "0.5"))
+# Differences below these are noise, whatever the ratio
+MIN_DURATION_DELTA_SECONDS = 2.0
+MIN_MEMORY_DELTA_MB = 100.0
+
+PIPELINE_STAGE = "Pipeline"
+
+_runs = {}  # job_name -> active run {"run_id", "started_at", "stages": {stage: record}}
+_runs_lock = threading.Lock()
+
+
+# ================================
+# 1. Collecting
+# ================================
+
+def start_run(job_name):
+    """Starts collecting the stage metrics of a job run; stages report to it through record_stage(job_name, ...)."""
+    run = {"run_id": f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}", "job_name": job_name,
+           "started_at": datetime.now().isoformat(), "stages": {}}
+    with _runs_lock:
+        _runs[job_name] = run
+    return run
+
+
+def _row_count(value):
+    # DataFrames (and anything with a shape); generators and None have no row count
+    return int(value.shape[0]) if hasattr(value, "shape") else None
+
+
+def record_stage(job_name, stage, resources, status="success", retries=0, data_in=None, data_out=None):
+    """
+    Adds one execution of a stage to the active run of `job_name` (no-op outside a run). Repeated executions,
+    e.g. Transform/Load of every batch in stream mode, are aggregated into one record with a batch count.
+    """
+    with _runs_lock:
+        run = _runs.get(job_name)
+        if run is None:
+            return
+        record = run["stages"].setdefault(stage, {
+            "status": "success", "duration_seconds": 0.0, "cpu_user_seconds": 0.0, "cpu_system_seconds": 0.0,
+            "rows_in": None, "rows_out": None, "read_bytes": None, "write_bytes": None, "peak_rss_mb": 0.0,
+            "peak_threads": 0, "batches": 0, "retries": 0,
+        })
+        record["batches"] += 1
+        record["retries"] += retries
+        if status != "success":
+            record["status"] = status
+        for key in ("duration_seconds", "cpu_user_seconds", "cpu_system_seconds"):
+            record[key] += resources.get(key) or 0.0
+        for key in ("read_bytes", "write_bytes"):
+            if resources.get(key) is not None:
+                record[key] = (record[key] or 0) + resources[key]
+        for key, rows in (("rows_in", _row_count(data_in)), ("rows_out", _row_count(data_out))):
+            if rows is not None:
+                record[key] = (record[key] or 0) + rows
+        record["peak_rss_mb"] = max(record["peak_rss_mb"], resources.get("peak_rss_mb") or 0.0)
+        record["peak_threads"] = max(record["peak_threads"], resources.get("peak_threads") or 0)
+
+
+def finish_run(job_name, status, resources=None, logger=None, **extra):
+    """
+    Ends the active run of `job_name`: appends its records to the history, rewrites the job's Prometheus
+    textfile and logs a warning for every regression against the rolling baseline. Never raises, so a metrics
+    problem cannot fail an ETL run. Returns the regressions found.
+    """
+    logger = logger or logging.getLogger(__name__)
+    with _runs_lock:
+        run = _runs.pop(job_name, None)
+    if run is None:
+        return []
+
+    resources = resources or {}
+    pipeline = {
+        "status": status,
+        "duration_seconds": resources.get("duration_seconds"),
+        "cpu_user_seconds": resources.get("cpu_user_seconds"),
+        "cpu_system_seconds": resources.get("cpu_system_seconds"),
+        "read_bytes": resources.get("read_bytes"),
+        "write_bytes": resources.get("write_bytes"),
+        "peak_rss_mb": resources.get("peak_rss_mb"),
+        "peak_threads": resources.get("peak_threads"),
+        "batches": extra.pop("batches", None),
+        "rows_out": extra.pop("rows", None),
+        "retries": sum(record["retries"] for record in run["stages"].values()),
+    }
+    header = {"run_id": run["run_id"], "job_name": job_name, "started_at": run["started_at"], "finished_at": datetime.now().isoformat()}
+    records = [{**header, "stage": stage, **record} for stage, record in run["stages"].items()]
+    records.append({**header, "stage": PIPELINE_STAGE, **pipeline, **extra})
+
+    try:
+        history = load_history(job_name)
+        regressions = detect_regressions(records, history) if status == "success" else []
+        for regression in regressions:
+            logger.warning(f"⚠️ Performance regression in {job_name}: {format_regression(regression)}")
+        append_history(records)
+        write_prometheus_textfile(job_name, records, regressions)
+        return regressions
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to record run metrics of {job_name}: {e}")
+        return []
+
+
+# ================================
+# 2. Storage (JSONL history, Prometheus textfile)
+# ================================
+
+def append_history(records, history_file=None):
+    history_file = history_file or METRICS_HISTORY_FILE
+    os.makedirs(os.path.dirname(history_file), exist_ok=True)
+    # One write per run, in append mode, so concurrent jobs do not interleave lines
+    with open(history_file, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(record, default=str) + "\n" for record in records))
+
+
+def load_history(job_name=None, history_file=None):
+    """Records of the history, oldest first, optionally of one job."""
+    history_file = history_file or METRICS_HISTORY_FILE
+    if not os.path.exists(history_file):
+        return []
+    records = []
+    with open(history_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Partial line of an interrupted write
+            if job_name is None or record.get("job_name") == job_name:
+                records.append(record)
+    return records
+
+
+def _prometheus_labels(**labels):
+    escaped = {key: str(value).replace("\\", "\\\\").replace('"', '\\"') for key, value in labels.items()}
+    return ",".join(f'{key}="{value}"' for key, value in escaped.items())
+
+
+PROMETHEUS_METRICS = {
+    "duration_seconds": ("etl_stage_duration_seconds", "Wall time of the stage in the last run."),
+    "cpu_user_seconds": ("etl_stage_cpu_user_seconds", "User CPU time of the stage in the last run."),
+    "cpu_system_seconds": ("etl_stage_cpu_system_seconds", "System CPU time of the stage in the last run."),
+    "rows_out": ("etl_stage_rows", "Rows produced by the stage in the last run."),
+    "read_bytes": ("etl_stage_read_bytes", "Bytes read from disk by the process during the stage."),
+    "write_bytes": ("etl_stage_write_bytes", "Bytes written to disk by the process during the stage."),
+    "peak_rss_mb": ("etl_stage_peak_rss_megabytes", "Peak resident memory of the process during the stage."),
+    "batches": ("etl_stage_batches", "Executions of the stage (batches in stream mode)."),
+    "retries": ("etl_stage_retries", "Retried attempts of the stage."),
+}
+
+
+def write_prometheus_textfile(job_name, records, regressions=(), textfile_dir=None):
+    """Writes the last run of a job as etl_<job_name>.prom (atomically, as the textfile collector requires)."""
+    textfile_dir = textfile_dir or PROMETHEUS_TEXTFILE_DIR
+    os.makedirs(textfile_dir, exist_ok=True)
+    lines = []
+    for field, (name, help_text) in PROMETHEUS_METRICS.items():
+        samples = [(record["stage"], record[field]) for record in records if record.get(field) is not None]
+        if samples:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{{{_prometheus_labels(job=job_name, stage=stage)}}} {float(value)}" for stage, value in samples]
+
+    pipeline = next(record for record in records if record["stage"] == PIPELINE_STAGE)
+    lines += ["# HELP etl_run_success Whether the last run of the job succeeded.", "# TYPE etl_run_success gauge",
+              f"etl_run_success{{{_prometheus_labels(job=job_name)}}} {1 if pipeline['status'] == 'success' else 0}",
+              "# HELP etl_run_finished_timestamp_seconds When the last run of the job finished.",
+              "# TYPE etl_run_finished_timestamp_seconds gauge",
+              f"etl_run_finished_timestamp_seconds{{{_prometheus_labels(job=job_name)}}} {time.time():.0f}",
+              "# HELP etl_stage_regression Whether the stage regressed against its rolling baseline in the last run.",
+              "# TYPE etl_stage_regression gauge"]
+    flagged = {(regression["stage"], regression["metric"]) for regression in regressions}
+    for record in records:
+        for metric in ("duration_seconds", "peak_rss_mb"):
+            value = 1 if (record["stage"], metric) in flagged else 0
+            lines.append(f"etl_stage_regression{{{_prometheus_labels(job=job_name, stage=record['stage'], metric=metric)}}} {value}")
+
+    path = os.path.join(textfile_dir, f"etl_{job_name}.prom")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+# ================================
+# 3. Regression detection
+# ================================
+
+def _per_row(record):
+    rows = record.get("rows_in") or record.get("rows_out")
+    duration = record.get("duration_seconds")
+    return duration / rows if rows and duration is not None else None
+
+
+def detect_regressions(records, history, window=BASELINE_RUNS, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compares the stages of a run with the median of the same stage over the last `window` successful runs of the
+    job. A stage regressed when its duration exceeds the baseline by more than `tolerance` (and by at least
+    MIN_DURATION_DELTA_SECONDS) while its time per row grew as much, so a day with many more rows is not
+    flagged; or when its peak RSS exceeds the baseline by more than `tolerance` and MIN_MEMORY_DELTA_MB.
+    """
+    regressions = []
+    run_ids = {record["run_id"] for record in records}
+    for record in records:
+        if record.get("status") != "success":
+            continue
+        baseline = [
+            past for past in history
+            if past["stage"] == record["stage"] and past.get("status") == "success" and past["run_id"] not in run_ids
+        ][-window:]
+        if len(baseline) < MIN_BASELINE_RUNS:
+            continue
+
+        duration = record.get("duration_seconds")
+        durations = [past["duration_seconds"] for past in baseline if past.get("duration_seconds") is not None]
+        if duration is not None and durations:
+            median_duration = statistics.median(durations)
+            per_row = _per_row(record)
+            per_rows = [value for value in map(_per_row, baseline) if value is not None]
+            slower_per_row = per_row is None or not per_rows or per_row > statistics.median(per_rows) * (1 + tolerance)
+            if duration > median_duration * (1 + tolerance) and duration - median_duration >= MIN_DURATION_DELTA_SECONDS and slower_per_row:
+                regressions.append({"stage": record["stage"], "metric": "duration_seconds", "value": duration, "baseline": median_duration})
+
+        peak = record.get("peak_rss_mb")
+        peaks = [past["peak_rss_mb"] for past in baseline if past.get("peak_rss_mb") is not None]
+        if peak is not None and peaks:
+            median_peak = statistics.median(peaks)
+            if peak > median_peak * (1 + tolerance) and peak - median_peak >= MIN_MEMORY_DELTA_MB:
+                regressions.append({"stage": record["stage"], "metric": "peak_rss_mb", "value": peak, "baseline": median_peak})
+    return regressions
+
+
+def format_regression(regression):
+    unit = "s" if regression["metric"] == "duration_seconds" else " MB"
+    return (f"{regression['stage']} {regression['metric']} {regression['value']:.2f}{unit} "
+            f"vs baseline {regression['baseline']:.2f}{unit} ({regression['value'] / regression['baseline']:.1f}x)")
+
+
+# ================================
+# 4. CLI: check the latest run of a job
+# ================================
+
+def latest_run(history):
+    run_id = history[-1]["run_id"] if history else None
+    return [record for record in history if record["run_id"] == run_id]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the latest run of ETL jobs with their rolling baseline.")
+    parser.add_argument("jobs", nargs="*", help="Job names, e.g. daily_SRC_custinvoicejour (default: every job in the history).")
+    parser.add_argument("--history", default=METRICS_HISTORY_FILE, help="JSONL metrics history.")
+    parser.add_argument("--window", type=int, default=BASELINE_RUNS, help="Number of previous runs forming the baseline.")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="Allowed growth over the baseline.")
+    args = parser.parse_args()
+
+    history = load_history(history_file=args.history)
+    jobs = args.jobs or sorted({record["job_name"] for record in history})
+    regressed = False
+    for job in jobs:
+        job_history = [record for record in history if record["job_name"] == job]
+        records = latest_run(job_history)
+        if not records:
+            print(f"{job}: no runs recorded")
+            continue
+        regressions = detect_regressions(records, job_history, window=args.window, tolerance=args.tolerance)
+        regressed = regressed or bool(regressions)
+        print(f"{job}: run {records[0]['run_id']} — {'regressed' if regressions else 'ok'}")
+        for regression in regressions:
+            print(f"  {format_regression(regression)}")
+    sys.exit(1 if regressed else 0)
@@ -0,0 +1,188 @@
+import os
+import sys
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(current_path)
+
+import io
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from logs.etl_metrics import PIPELINE_STAGE
+
+# Opt-in profiling of ETL stages, configured through environment variables (main_ETL_runner's --profile and
+# --profile-stages set them for its workers):
+#
+#   ETL_PROFILE=cpu,memory          profilers to run: "cpu" (cProfile, .prof + top functions), "sampling" (wall-clock
+#                                   stack sampler, folded stacks for flamegraph.pl / speedscope) and "memory"
+#                                   (tracemalloc snapshot diff, top allocating lines)
+#   ETL_PROFILE_STAGES=Transform    stages to profile (default: every track_performance stage; "Pipeline" = whole run)
+#   ETL_PROFILE_DIR                 where reports are written (default: logs/profiles, next to the run logs)
+#
+# Settings are read when a stage starts, so they can be changed without re-importing the modules.
+
+PROFILERS = ("cpu", "sampling", "memory")
+
+_profile_lock = threading.Lock()  # cProfile and tracemalloc are process-wide: one profiled stage at a time
+_profiled_counts = Counter()  # (job_name, stage) -> executions profiled in this process
+
+
+def get_profile_settings():
+    profilers = [name.strip() for name in os.getenv("ETL_PROFILE", "").split(",") if name.strip()]
+    unknown = [name for name in profilers if name not in PROFILERS]
+    if unknown:
+        logging.warning(f"⚠️ Ignoring unknown profilers {unknown}; choose from {PROFILERS}.")
+    stages = [name.strip() for name in os.getenv("ETL_PROFILE_STAGES", "").split(",") if name.strip()]
+    return {
+        "profilers": [name for name in profilers if name in PROFILERS],
+        "stages": stages,
+        "output_dir": os.getenv("ETL_PROFILE_DIR", os.path.join(current_path, 'profiles')),
+        # Executions of a stage profiled per job, so stream mode does not write one report per batch
+        "max_executions": int(os.getenv("ETL_PROFILE_MAX_EXECUTIONS", "1")),
+        "sampling_interval": float(os.getenv("ETL_PROFILE_SAMPLING_INTERVAL", "0.005")),
+        "tracemalloc_frames": int(os.getenv("ETL_PROFILE_TRACEMALLOC_FRAMES", "10")),
+        "top": int(os.getenv("ETL_PROFILE_TOP", "30")),
+    }
+
+
+def _stage_selected(stage_name, stages):
+    if stages:
+        return stage_name in stages
+    return stage_name != PIPELINE_STAGE  # The whole run only when asked for, as it would hide every stage
+
+
+class StackSampler:
+    """Wall-clock sampling profiler: records the stack of every thread every `interval` seconds on a daemon thread."""
+
+    IGNORED_THREADS = ("StackSampler", "ResourceSampler")
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="StackSampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                thread_name = names.get(ident, str(ident))
+                if thread_name.startswith(self.IGNORED_THREADS):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.counts[";".join([thread_name] + stack[::-1])] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_folded(self, path):
+        """Folded stacks ("frame;frame;frame count" per line), the input of flamegraph.pl and speedscope."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _write_cpu_report(profiler, base_path, top):
+    profiler.dump_stats(f"{base_path}.prof")
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats("cumulative").print_stats(top)
+    stats.sort_stats("tottime").print_stats(top)
+    with open(f"{base_path}_cpu.txt", "w", encoding="utf-8") as f:
+        f.write(report.getvalue())
+    return [f"{base_path}.prof", f"{base_path}_cpu.txt"]
+
+
+def _write_memory_report(before, after, peak, base_path, top):
+    lines = [f"Peak traced memory: {peak / 1024 / 1024:.2f} MB", "", f"Top {top} allocation differences by line:"]
+    lines += [str(stat) for stat in after.compare_to(before, "lineno")[:top]]
+    lines += ["", f"Top {top} allocation differences by traceback:"]
+    for stat in after.compare_to(before, "traceback")[:top]:
+        lines.append(f"{stat.size_diff / 1024:+.1f} KiB in {stat.count_diff:+d} blocks")
+        lines += [f"    {line}" for line in stat.traceback.format()]
+    path = f"{base_path}_memory.txt"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return [path]
+
+
+@contextmanager
+def profile_stage(job_name, stage_name, logger=None):
+    """
+    Profiles the block with the profilers enabled in ETL_PROFILE when `stage_name` is selected; otherwise (the
+    default) it does nothing. Reports are named <job>_<stage>_<timestamp> in the profile directory.
+    """
+    settings = get_profile_settings()
+    if not settings["profilers"] or not _stage_selected(stage_name, settings["stages"]):
+        yield
+        return
+
+    logger = logger or logging.getLogger(__name__)
+    key = (job_name, stage_name)
+    if _profiled_counts[key] >= settings["max_executions"] or not _profile_lock.acquire(blocking=False):
+        # Already profiled enough times, or another stage of this process is being profiled
+        yield
+        return
+
+    _profiled_counts[key] += 1
+    profilers = settings["profilers"]
+    cpu_profiler = sampler = before = None
+    started_tracemalloc = False
+    try:
+        if "memory" in profilers:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(settings["tracemalloc_frames"])
+                started_tracemalloc = True
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        if "sampling" in profilers:
+            sampler = StackSampler(settings["sampling_interval"])
+            sampler.start()
+        if "cpu" in profilers:
+            cpu_profiler = cProfile.Profile()
+            cpu_profiler.enable()
+
+        yield
+
+    finally:
+        try:
+            if cpu_profiler:
+                cpu_profiler.disable()
+            if sampler:
+                sampler.stop()
+            if before is not None:
+                after = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                if started_tracemalloc:
+                    tracemalloc.stop()
+
+            os.makedirs(settings["output_dir"], exist_ok=True)
+            base_path = os.path.join(settings["output_dir"], f"{job_name}_{stage_name}_{datetime.now():%Y%m%dT%H%M%S}")
+            reports = []
+            if cpu_profiler:
+                reports += _write_cpu_report(cpu_profiler, base_path, settings["top"])
+            if sampler:
+                sampler.write_folded(f"{base_path}.folded")
+                reports.append(f"{base_path}.folded")
+            if before is not None:
+                reports += _write_memory_report(before, after, peak, base_path, settings["top"])
+            logger.info(f"🔬 Profiled {stage_name} ({', '.join(profilers)}): {', '.join(reports)}")
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to write profile of {stage_name}: {e}")
+        finally:
+            _profile_lock.release()
@@ -0,0 +1,238 @@
+import os
+import sys
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(current_path)
+
+import json
+import time
+import uuid
+import logging
+import functools
+import threading
+from datetime import datetime
+
+# Nested timing spans inside the ETL stages (GCS reads, Parquet decoding, schema transform, ClickHouse queries,
+# pool checkouts, ...), exported per run as a Chrome trace (chrome://tracing, https://ui.perfetto.dev) or as
+# OpenTelemetry OTLP/JSON.
+#
+#   with span("clickhouse.insert_batch", rows=len(batch)):
+#       ...
+#
+#   @traced("schema.transform")
+#   def transform_dataframe_to_schema(...):
+#
+# Disabled by default: span() then returns a shared no-op object and traced() calls the function directly,
+# so instrumented code only pays for one attribute lookup.
+
+TRACE_ENABLED = os.getenv("ETL_TRACE", "0") == "1"
+TRACE_DIR = os.getenv("ETL_TRACE_DIR", os.path.join(os.path.dirname(current_path), 'state', 'traces'))
+TRACE_FORMAT = os.getenv("ETL_TRACE_FORMAT", "chrome")  # "chrome" or "otlp"
+TRACE_FORMATS = ("chrome", "otlp")
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """One timed operation; nested spans opened in the same thread become its children."""
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = None
+        self.error = None
+
+    def set(self, **attributes):
+        """Adds attributes known only once the operation ran (row counts, bytes, ...)."""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.parent_id = stack[-1].span_id if stack else None
+        stack.append(self)
+        self.thread_id = threading.get_native_id()
+        self.start_ns = time.time_ns()
+        self._start_counter = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ns = time.perf_counter_ns() - self._start_counter
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        stack = self.tracer._stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.tracer._record(self)
+        return False
+
+
+class Tracer:
+    """
+    Collects the spans of the process. A trace starts with start_trace(job_name) and is exported by
+    finish_trace(job_name); spans from worker threads (insert workers, streamed batches) are included.
+    When several jobs run as threads of one process, each trace also holds the other jobs' concurrent spans.
+    """
+
+    def __init__(self, enabled=TRACE_ENABLED):
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._spans = []
+        self._traces = {}  # job_name -> {"trace_id", "started_ns"}
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, span):
+        with self._lock:
+            if self._traces:
+                self._spans.append(span)
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def start_trace(self, job_name):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._traces[job_name] = {"trace_id": uuid.uuid4().hex, "started_ns": time.time_ns()}
+
+    def finish_trace(self, job_name, output_dir=None, trace_format=None, logger=None):
+        """
+        Writes the spans recorded since start_trace(job_name) and returns the file path (None when disabled).
+        Never raises, so tracing cannot fail an ETL run.
+        """
+        if not self.enabled:
+            return None
+        logger = logger or logging.getLogger(__name__)
+        with self._lock:
+            trace = self._traces.pop(job_name, None)
+            if trace is None:
+                return None
+            spans = [span for span in self._spans if span.start_ns >= trace["started_ns"]]
+            if not self._traces:
+                self._spans = []
+
+        trace_format = trace_format or TRACE_FORMAT
+        if trace_format not in TRACE_FORMATS:
+            logger.warning(f"⚠️ Unsupported trace format {trace_format!r} (choose from {TRACE_FORMATS}); writing a Chrome trace.")
+            trace_format = "chrome"
+        content = to_chrome_trace(spans, job_name) if trace_format == "chrome" else to_otlp_json(spans, job_name, trace["trace_id"])
+
+        output_dir = output_dir or TRACE_DIR
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            path = os.path.join(output_dir, f"trace_{job_name}_{datetime.now():%Y%m%dT%H%M%S}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(content, f, default=str)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"⚠️ Failed to write trace of {job_name}: {e}")
+            return None
+        logger.info(f"🧭 Trace of {job_name} ({len(spans)} spans) written to {path}")
+        return path
+
+
+def to_chrome_trace(spans, job_name):
+    """Chrome Trace Event format: one complete ("X") event per span, timestamps in microseconds."""
+    events = []
+    for span in spans:
+        args = dict(span.attributes)
+        if span.error:
+            args["error"] = span.error
+        events.append({
+            "name": span.name,
+            "cat": span.name.split(".")[0],
+            "ph": "X",
+            "ts": span.start_ns / 1000,
+            "dur": span.duration_ns / 1000,
+            "pid": os.getpid(),
+            "tid": span.thread_id,
+            "args": args,
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"job_name": job_name}}
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp_json(spans, job_name, trace_id):
+    """OpenTelemetry OTLP/JSON (ExportTraceServiceRequest), as accepted by an OTLP/HTTP collector."""
+    otlp_spans = []
+    for span in spans:
+        otlp_span = {
+            "traceId": trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.start_ns + span.duration_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in {**span.attributes, "thread.id": span.thread_id}.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        otlp_spans.append(otlp_span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": "etl"}},
+            {"key": "etl.job_name", "value": {"stringValue": job_name}},
+        ]},
+        "scopeSpans": [{"scope": {"name": "etl_tracing"}, "spans": otlp_spans}],
+    }]}
+
+
+tracer = Tracer()
+
+
+def span(name, **attributes):
+    """Context manager timing a block as a span of the current trace (a no-op when tracing is disabled)."""
+    return tracer.span(name, **attributes)
+
+
+def traced(name=None):
+    """Decorator recording every call of the function as a span named `name` (default: module.function)."""
+    def decorator(func):
+        span_name = name or f"{func.__module__.split('.')[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with Span(tracer, span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_trace(job_name):
+    tracer.start_trace(job_name)
+
+
+def finish_trace(job_name, logger=None):
+    return tracer.finish_trace(job_name, logger=logger)
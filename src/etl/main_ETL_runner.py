@@ -0,0 +1,137 @@
+import os
+import sys
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(current_path)
+
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from modules.table_job import SYNC_MODES, LOAD_MODES, SKIP_UNCHANGED, TableETLJob, get_configured_tables, load_storage_config, find_unchanged_tables
+from modules.db_connector import close_all_connections
+from modules.watermark_store import check_watermark_store
+from logs.etl_logger import setup_logger
+
+# Runs the ETL job of every table configured in models/storage_models.yaml and models/clickhouse_models.yaml,
+# several tables at a time, so a full sync takes about as long as the slowest table instead of the sum.
+job_name = "main_ETL_runner"
+
+MAX_WORKERS = int(os.getenv("ETL_MAX_PARALLEL_TABLES", "4"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the ETL jobs of all configured tables concurrently.")
+    parser.add_argument("--mode", choices=SYNC_MODES, default="daily", help="Sync mode of every table job.")
+    parser.add_argument("--database", default="prod_source", help="Target ClickHouse database.")
+    parser.add_argument("--tables", nargs="+", help="Only run these file keys (default: every configured table).")
+    parser.add_argument("--max-workers", type=int, default=MAX_WORKERS, help="Maximum number of tables processed at the same time.")
+    parser.add_argument("--executor", choices=("process", "thread"), default="process",
+                        help="Run tables in separate processes (isolated logs and memory) or threads of this process.")
+    parser.add_argument("--load-mode", choices=LOAD_MODES, default="native", help="ClickHouse insert format.")
+    parser.add_argument("--stream", action="store_true", help="Extract, transform and load each table in bounded batches.")
+    parser.add_argument("--stream-batch-rows", type=int, default=100000, help="Rows per batch in stream mode.")
+    parser.add_argument("--force", action="store_true", help="Run every table, even those whose file is unchanged since the last run.")
+    parser.add_argument("--profile", help="Comma-separated profilers to run per stage: cpu, sampling, memory (sets ETL_PROFILE).")
+    parser.add_argument("--profile-stages", help="Comma-separated stages to profile, e.g. Transform (sets ETL_PROFILE_STAGES; default every stage).")
+    return parser.parse_args()
+
+
+# Module-level so it can be pickled for the process pool
+def run_table_job(file_key, table_name, options, source_version=None):
+    job = TableETLJob(file_key, table_name=table_name, **options)
+    return job.run(source_version=source_version)
+
+
+def select_tables(database_name, requested, logger):
+    configured = get_configured_tables(database_name)
+    for file_key in load_storage_config()["gcs"]["files"]:
+        if file_key not in configured:
+            logger.warning(f"⚠️ Skipping {file_key}: no ClickHouse model in {database_name}.")
+
+    if not requested:
+        return configured
+    unknown = [key for key in requested if key not in configured]
+    if unknown:
+        raise ValueError(f"Tables not configured for {database_name}: {', '.join(unknown)}")
+    return {key: configured[key] for key in requested}
+
+
+def skip_unchanged_tables(database_name, tables, mode, logger):
+    """
+    Drops the tables whose file is unchanged since their last run, from one metadata listing and one watermark
+    query for all tables. Returns (tables to run, {file_key: source_version}).
+    """
+    try:
+        unchanged, versions = find_unchanged_tables(database_name, tables, mode)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not check for unchanged files, running every table: {e}")
+        return tables, {}
+    for key in unchanged:
+        logger.info(f"⏭️ Skipping {key}: {tables[key]} source file is unchanged since the last {mode} run.")
+    return {key: table_name for key, table_name in tables.items() if key not in unchanged}, versions
+
+
+def run_all(tables, options, max_workers, executor_type, logger, source_versions=None):
+    """Runs one job per table with at most `max_workers` at a time; returns {file_key: succeeded}."""
+    executor_class = ProcessPoolExecutor if executor_type == "process" else ThreadPoolExecutor
+    source_versions = source_versions or {}
+    results = {}
+    if not tables:
+        return results
+    with executor_class(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_table_job, key, table_name, options, source_versions.get(key)): key for key, table_name in tables.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = bool(future.result())
+            except Exception as e:
+                logger.error(f"Job for {key} crashed: {e}", exc_info=True)
+                results[key] = False
+            logger.info(f"{'✅' if results[key] else '❌'} {key} finished ({len(results)}/{len(futures)}).")
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logger = setup_logger(job_name)
+
+    # Set before the workers start so that they inherit them
+    if args.profile:
+        os.environ["ETL_PROFILE"] = args.profile
+    if args.profile_stages:
+        os.environ["ETL_PROFILE_STAGES"] = args.profile_stages
+
+    # Fail once with a clear message instead of in every job
+    try:
+        check_watermark_store()
+    except RuntimeError as e:
+        logger.critical(str(e))
+        sys.exit(1)
+    finally:
+        close_all_connections()  # Opened in this process only; workers open their own
+
+    tables = select_tables(args.database, args.tables, logger)
+    options = {
+        "database_name": args.database,
+        "mode": args.mode,
+        "load_mode": args.load_mode,
+        "stream_mode": args.stream,
+        "stream_batch_rows": args.stream_batch_rows,
+        "skip_unchanged": SKIP_UNCHANGED and not args.force,
+    }
+
+    start_time = time.time()
+    source_versions = {}
+    if options["skip_unchanged"]:
+        tables, source_versions = skip_unchanged_tables(args.database, tables, args.mode, logger)
+    # The checks above used ClickHouse; do not hand their open connections to the workers
+    close_all_connections()
+    logger.info(f"Running {args.mode} ETL for {len(tables)} table(s) with up to {args.max_workers} {args.executor} worker(s).")
+    results = run_all(tables, options, args.max_workers, args.executor, logger, source_versions)
+
+    failed = sorted(key for key, succeeded in results.items() if not succeeded)
+    logger.info(f"ETL runner completed in {time.time() - start_time:.2f} seconds: "
+                f"{len(results) - len(failed)} succeeded, {len(failed)} failed.")
+    if failed:
+        logger.error(f"Failed tables: {', '.join(failed)}")
+        sys.exit(1)
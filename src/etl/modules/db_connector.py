@@ -1,39 +1,210 @@
 import os
 import sys
+import time
 import yaml
+import logging
+import threading
 import clickhouse_connect
+from contextlib import contextmanager
+from clickhouse_connect.driver import httputil
 
 # Set up paths
 current_path = os.path.dirname(os.path.realpath(__file__))
 parent_path = os.path.dirname(os.path.dirname(os.path.dirname(current_path)))
 sys.path.append(parent_path)
+sys.path.append(os.path.dirname(current_path))
+
+from logs.etl_tracing import span, traced
+
+# Maximum number of clients kept per database, i.e. concurrent checkouts before callers wait
+MAX_POOL_SIZE = int(os.getenv("CLICKHOUSE_POOL_SIZE", "8"))
+
+# Idle clients are pinged again only after this many seconds
+HEALTH_CHECK_INTERVAL = int(os.getenv("CLICKHOUSE_HEALTH_CHECK_INTERVAL", "60"))
+
+_config = None
+_config_lock = threading.Lock()
+
+_http_pool_manager = None
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# Load ClickHouse credentials once per process
+def load_clickhouse_config():
+    global _config
+    with _config_lock:
+        if _config is None:
+            with open(f'{parent_path}/config/clickhouse_credentials.yaml', "r") as f:
+                _config = yaml.safe_load(f)
+        return _config
 
-def get_clickhouse_connection(database_name):
-    try:
-        # Load config
-        with open(f'{parent_path}/config/clickhouse_credentials.yaml', "r") as f:
-            config = yaml.safe_load(f)
-        
-        # Use the provided database_name or fallback to config file
-        db_name = database_name if database_name else config["clickhouse"].get("database", "default")
-
-        # Connect to ClickHouse
-        client = clickhouse_connect.get_client(
-            host=config["clickhouse"]["host"],
-            port=config["clickhouse"]["port"],
-            user=config["clickhouse"]["user"],
-            password=config["clickhouse"]["password"],
-            database=db_name,
-            secure=True
-        )
-
-        # Check if the database exists
-        result = client.query(f"SHOW DATABASES LIKE '{db_name}'").result_set
-        if not result:
-            raise ValueError(f"Database '{db_name}' does not exist in ClickHouse!")
 
+# One keep-alive HTTP connection pool shared by every client in the process
+def get_http_pool_manager():
+    global _http_pool_manager
+    with _pools_lock:
+        if _http_pool_manager is None:
+            _http_pool_manager = httputil.get_pool_manager(maxsize=MAX_POOL_SIZE, num_pools=4, block=False)
+        return _http_pool_manager
+
+
+def _create_client(db_name):
+    config = load_clickhouse_config()
+    return clickhouse_connect.get_client(
+        host=config["clickhouse"]["host"],
+        port=config["clickhouse"]["port"],
+        user=config["clickhouse"]["user"],
+        password=config["clickhouse"]["password"],
+        database=db_name,
+        secure=True,
+        pool_mgr=get_http_pool_manager(),
+        autogenerate_session_id=False,  # No server session, so a client can be shared across threads
+    )
+
+
+class ClickHouseClientPool:
+    """
+    Thread-safe pool of ClickHouse clients for one database.
+
+    - `shared_client()` returns one long-lived client for callers that only run sequential queries.
+    - `checkout()` / `release()` hand out a client exclusively, creating up to `max_size` clients.
+    Clients are health checked lazily (a ping when idle longer than `health_check_interval`) and replaced if dead.
+    """
+
+    def __init__(self, database_name, max_size=MAX_POOL_SIZE, health_check_interval=HEALTH_CHECK_INTERVAL):
+        self.database_name = database_name
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self._idle = []  # (client, last_checked_at)
+        self._size = 0
+        self._shared = None
+        self._database_checked = False
+        self._condition = threading.Condition()
+
+    @traced("clickhouse.connect")
+    def _new_client(self):
+        client = _create_client(self.database_name)
+        if not self._database_checked:
+            # Check if the database exists (once per pool, not on every connection)
+            result = client.query(f"SHOW DATABASES LIKE '{self.database_name}'").result_set
+            if not result:
+                client.close()
+                raise ValueError(f"Database '{self.database_name}' does not exist in ClickHouse!")
+            self._database_checked = True
         return client
 
+    def _ensure_healthy(self, client, last_checked_at):
+        if time.time() - last_checked_at < self.health_check_interval:
+            return client
+        with span("clickhouse.ping", database=self.database_name):
+            healthy = client.ping()
+        if healthy:
+            return client
+        logging.warning(f"♻️ Replacing unhealthy ClickHouse client for database '{self.database_name}'.")
+        client.close()
+        return _create_client(self.database_name)
+
+    def shared_client(self):
+        with self._condition:
+            if self._shared is None:
+                self._shared = (self._new_client(), time.time())
+            client = self._ensure_healthy(*self._shared)
+            self._shared = (client, time.time())
+            return client
+
+    def checkout(self):
+        with self._condition:
+            if not self._idle and self._size >= self.max_size:
+                # Time spent waiting for a free client shows up in traces as pool contention
+                with span("clickhouse.pool.wait", database=self.database_name):
+                    while not self._idle and self._size >= self.max_size:
+                        self._condition.wait()
+            if self._idle:
+                client, last_checked_at = self._idle.pop()
+            else:
+                self._size += 1
+                last_checked_at = time.time()
+                try:
+                    client = self._new_client()
+                except Exception:
+                    self._size -= 1
+                    raise
+        try:
+            return self._ensure_healthy(client, last_checked_at)
+        except Exception:
+            self.release(None)
+            raise
+
+    def release(self, client):
+        with self._condition:
+            if client is None:
+                self._size -= 1
+            else:
+                self._idle.append((client, time.time()))
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            clients = [client for client, _ in self._idle]
+            if self._shared:
+                clients.append(self._shared[0])
+            for client in clients:
+                client.close()
+            self._idle, self._shared, self._size = [], None, 0
+
+
+# Process-wide registry of client pools keyed by database
+def get_client_pool(database_name):
+    db_name = database_name if database_name else load_clickhouse_config()["clickhouse"].get("database", "default")
+    with _pools_lock:
+        if db_name not in _pools:
+            _pools[db_name] = ClickHouseClientPool(db_name)
+        return _pools[db_name]
+
+
+# Exclusive client for concurrent work, returned to the pool on exit
+@contextmanager
+def clickhouse_client(database_name):
+    pool = get_client_pool(database_name)
+    client = pool.checkout()
+    try:
+        yield client
+    finally:
+        pool.release(client)
+
+
+def close_all_connections():
+    """Closes every pooled client and the shared HTTP connection pool; they are recreated on the next use."""
+    global _http_pool_manager
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+        pool_manager, _http_pool_manager = _http_pool_manager, None
+    for pool in pools:
+        pool.close()
+    if pool_manager is not None:
+        pool_manager.clear()
+
+
+# A forked worker (ProcessPoolExecutor on Linux) inherits the parent's clients and their keep-alive TLS sockets.
+# Sharing one socket between processes interleaves their requests, so the child drops its copies (without closing
+# them, which would shut down the parent's connections) and opens its own on first use.
+def _reset_after_fork():
+    global _http_pool_manager, _pools, _pools_lock
+    _pools_lock = threading.Lock()
+    _pools = {}
+    _http_pool_manager = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_clickhouse_connection(database_name):
+    """Returns the process-wide shared client for the database (do not close it)."""
+    try:
+        return get_client_pool(database_name).shared_client()
+
     except Exception as e:
         print(f"Error connecting to ClickHouse: {e}")
         return None  # Return None if the connection fails
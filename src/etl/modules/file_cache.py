@@ -0,0 +1,111 @@
+import os
+import sys
+import uuid
+import hashlib
+import logging
+import threading
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+parent_path = os.path.dirname(current_path)
+sys.path.append(parent_path)
+
+# Local copies of GCS objects, one file per (bucket, path, generation). A generation is immutable, so a cached
+# file never needs revalidation: a rewritten object gets a new generation and therefore a new cache entry.
+CACHE_DIR = os.getenv("GCS_CACHE_DIR", os.path.join(parent_path, 'state', 'gcs_cache'))
+
+# Total size the cache may use; least recently used files are evicted beyond it (0 disables the cache)
+CACHE_MAX_BYTES = int(os.getenv("GCS_CACHE_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))
+
+_cache_lock = threading.Lock()
+
+
+def enabled():
+    return CACHE_MAX_BYTES > 0
+
+
+def _object_prefix(bucket_name, blob_name):
+    digest = hashlib.sha256(f"{bucket_name}/{blob_name}".encode("utf-8")).hexdigest()[:32]
+    return f"{digest}-"
+
+
+def _entry_path(bucket_name, blob_name, generation):
+    extension = os.path.splitext(blob_name)[1]
+    return os.path.join(CACHE_DIR, f"{_object_prefix(bucket_name, blob_name)}{generation}{extension}")
+
+
+def lookup(bucket_name, blob_name, generation):
+    """Path of the cached copy of this object generation, or None. A hit marks the entry as recently used."""
+    if not enabled() or generation is None:
+        return None
+    path = _entry_path(bucket_name, blob_name, generation)
+    try:
+        os.utime(path)  # The modification time is the LRU clock
+    except FileNotFoundError:
+        return None
+    logging.debug(f"Cache hit for gs://{bucket_name}/{blob_name} (generation {generation}).")
+    return path
+
+
+def store(bucket_name, blob_name, generation, download):
+    """
+    Adds an object generation to the cache and returns its path. `download(path)` writes the object to a
+    temporary file, which is renamed into place once complete, so readers (other threads or processes) never see
+    a partial file. Older generations of the same object are removed, then the cache is trimmed to CACHE_MAX_BYTES.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _entry_path(bucket_name, blob_name, generation)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        download(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    prefix = _object_prefix(bucket_name, blob_name)
+    with _cache_lock:
+        for name in os.listdir(CACHE_DIR):
+            stale = os.path.join(CACHE_DIR, name)
+            if name.startswith(prefix) and not name.endswith(".tmp") and stale != path:
+                _remove(stale)
+        evict(keep=path)
+    logging.debug(f"Cached gs://{bucket_name}/{blob_name} (generation {generation}) as {path}.")
+    return path
+
+
+def evict(max_bytes=None, keep=None):
+    """Removes least recently used entries until the cache holds at most `max_bytes` (CACHE_MAX_BYTES by default)."""
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for name in os.listdir(CACHE_DIR) if os.path.isdir(CACHE_DIR) else []:
+        if name.endswith(".tmp"):
+            continue
+        try:
+            stat = os.stat(os.path.join(CACHE_DIR, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, os.path.join(CACHE_DIR, name)))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        # Readers that memory-mapped the file keep their mapping; the space is freed once they close it
+        _remove(path)
+        total -= size
+        logging.debug(f"Evicted {path} from the GCS cache.")
+    return total
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def clear():
+    with _cache_lock:
+        return evict(max_bytes=0)
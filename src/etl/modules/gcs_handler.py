@@ -1,6 +1,17 @@
 from google.cloud import storage
-from datetime import datetime
+from google.api_core.exceptions import NotFound
+from datetime import date, datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import pandas as pd
+import numpy as np
+import operator
+import json
+import base64
+import google_crc32c
+from concurrent.futures import ThreadPoolExecutor
+import logging
 import pytz
 import os
 import sys
@@ -8,30 +19,419 @@ import sys
 current_path = os.path.dirname(os.path.realpath(__file__))
 parent_path = os.path.dirname(os.path.dirname(os.path.dirname(current_path)))
 sys.path.append(parent_path)
+sys.path.append(os.path.dirname(current_path))
+
+from modules import file_cache
+from logs.etl_tracing import span, traced
 
 def get_gcs_client():
     return storage.Client.from_service_account_json(f'{parent_path}/config/gcs_service_key.json')
 
-def read_gcs_file(bucket_name, file_path):
+# Supported comparison operators for read_gcs_file filters, e.g. [("MODIFIEDDATETIME", ">=", last_synced_at)]
+FILTER_OPERATORS = {
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+# Size of each ranged GET issued while reading Parquet footers and row groups
+RANGED_READ_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Default number of rows per DataFrame yielded by iter_gcs_file_batches
+DEFAULT_BATCH_ROWS = 100000
+
+# Full reads of objects at least this large are downloaded as concurrent byte ranges
+PARALLEL_DOWNLOAD_MIN_BYTES = int(os.getenv("GCS_PARALLEL_DOWNLOAD_MIN_BYTES", str(64 * 1024 * 1024)))
+DOWNLOAD_WORKERS = int(os.getenv("GCS_DOWNLOAD_WORKERS", "8"))
+DOWNLOAD_PART_SIZE = int(os.getenv("GCS_DOWNLOAD_PART_SIZE", str(32 * 1024 * 1024)))
+
+# Partitioned datasets (see src/data-lake/partitioned_dataset.py) are addressed by their folder, e.g. "raw/TABLE/"
+DATASET_MANIFEST_NAME = "_manifest.json"
+
+
+@traced("gcs.read_file")
+def read_gcs_file(bucket_name, file_path, columns=None, filters=None):
+    """
+    Reads a CSV/Parquet/JSON file from GCS into a DataFrame.
+
+    columns: optional list of columns to keep (e.g. the target ClickHouse schema). Columns missing from the
+    file are ignored; for Parquet and CSV the other columns are never decoded.
+    filters: optional list of (column, op, value) tuples combined with AND. For Parquet, row groups whose
+    min/max statistics cannot match are skipped and only the byte ranges of the remaining row groups are
+    fetched from GCS. Rows are then filtered exactly.
+
+    A path ending with "/" is read as a partitioned dataset: the parts listed in its manifest whose
+    statistics may match the filters are read and concatenated.
+
+    Parquet objects are kept in the local cache (modules/file_cache.py) by generation and memory-mapped from it.
+    """
     client = get_gcs_client()
     bucket = client.bucket(bucket_name)
+    wanted = _projection(columns, filters)
+    if _is_dataset(file_path):
+        return _read_dataset(bucket, file_path, wanted, filters)
     blob = bucket.blob(file_path)
     if file_path.endswith(".csv"):
-        return pd.read_csv(blob.open("r"))
+        usecols = (lambda col: col in wanted) if wanted else None
+        return _filter_dataframe(pd.read_csv(blob.open("r"), usecols=usecols), filters)
     elif file_path.endswith(".parquet"):
-        return pd.read_parquet(blob.open("rb"))
+        with _parquet_source(bucket, blob, filters) as source:
+            return _read_parquet(source, wanted, filters, file_path)
     elif file_path.endswith(".json"):
-        return pd.read_json(blob.open("r"))
+        df = pd.read_json(blob.open("r"))
+        if wanted:
+            df = df[[col for col in df.columns if col in wanted]]
+        return _filter_dataframe(df, filters)
     else:
         raise ValueError("Unsupported file format")
-    
+
+
+def iter_gcs_file_batches(bucket_name, file_path, columns=None, filters=None, batch_size=DEFAULT_BATCH_ROWS):
+    """
+    Streaming counterpart of read_gcs_file: yields DataFrames of at most `batch_size` rows.
+
+    Parquet is decoded record batch by record batch from the row groups that survive predicate pushdown,
+    so only one batch (plus the reader's buffer) is held in memory at a time.
+    """
+    client = get_gcs_client()
+    bucket = client.bucket(bucket_name)
+    wanted = _projection(columns, filters)
+    if _is_dataset(file_path):
+        for part_path in _list_dataset_parts(bucket, file_path, filters):
+            with _parquet_source(bucket, bucket.blob(part_path), filters, stream=True, immutable=True) as source:
+                yield from _iter_parquet_batches(source, wanted, filters, batch_size, part_path)
+        return
+    blob = bucket.blob(file_path)
+    if file_path.endswith(".csv"):
+        usecols = (lambda col: col in wanted) if wanted else None
+        with blob.open("r") as source:
+            for chunk in pd.read_csv(source, usecols=usecols, chunksize=batch_size):
+                yield _filter_dataframe(chunk, filters)
+    elif file_path.endswith(".parquet"):
+        with _parquet_source(bucket, blob, filters, stream=True) as source:
+            yield from _iter_parquet_batches(source, wanted, filters, batch_size, file_path)
+    elif file_path.endswith(".json"):
+        df = read_gcs_file(bucket_name, file_path, columns=columns, filters=filters)
+        for start in range(0, len(df), batch_size):
+            yield df.iloc[start:start + batch_size]
+    else:
+        raise ValueError("Unsupported file format")
+
+
+def _parquet_source(bucket, blob, filters, stream=False, immutable=False):
+    """
+    Opens a Parquet object for reading:
+    - a memory-mapped file from the local cache when this generation of the object is cached, so repeated reads
+      (retries, daily then monthly jobs, dev scripts) cost one metadata request and no copy;
+    - otherwise the object is downloaded into the cache first, unless the read is filtered and the object may be
+      rewritten (a raw file gets a new generation every day): predicate pushdown then fetches fewer bytes with
+      ranged reads. Dataset parts are immutable and always worth caching;
+    - without the cache, ranged reads for filtered or streaming reads and an in-memory download otherwise.
+    """
+    if file_cache.enabled():
+        blob.reload()
+        path = file_cache.lookup(bucket.name, blob.name, blob.generation)
+        if path is None and (immutable or not filters):
+            path = file_cache.store(bucket.name, blob.name, blob.generation, lambda tmp_path: download_blob_to_file(blob, tmp_path))
+        if path is not None:
+            return pa.memory_map(path, "r")
+    if filters or stream:
+        return blob.open("rb", chunk_size=RANGED_READ_CHUNK_SIZE)
+    return pa.BufferReader(download_blob(blob))
+
+
+def _download_ranges(blob, size, write):
+    """Fetches DOWNLOAD_PART_SIZE byte ranges on DOWNLOAD_WORKERS threads, all pinned to the blob's generation."""
+    def fetch(start):
+        end = min(start + DOWNLOAD_PART_SIZE, size) - 1
+        write(start, blob.download_as_bytes(start=start, end=end, if_generation_match=blob.generation, checksum=None))
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        list(executor.map(fetch, range(0, size, DOWNLOAD_PART_SIZE)))
+    logging.debug(f"Downloaded {blob.name} ({size / 1024 / 1024:.1f} MB) in {-(-size // DOWNLOAD_PART_SIZE)} parallel ranges.")
+
+
+def download_blob(blob):
+    """
+    Downloads a whole object into memory and returns it as an Arrow buffer.
+
+    Objects of at least PARALLEL_DOWNLOAD_MIN_BYTES are fetched as DOWNLOAD_PART_SIZE byte ranges on
+    DOWNLOAD_WORKERS threads, so large files are bound by bandwidth rather than per-request latency. Every range
+    is pinned to the same object generation and the assembled object is checked against its CRC32C.
+    """
+    if blob.generation is None:
+        blob.reload()
+    size = blob.size or 0
+    with span("gcs.download", object=blob.name, bytes=size):
+        if size < PARALLEL_DOWNLOAD_MIN_BYTES or DOWNLOAD_WORKERS <= 1:
+            return pa.py_buffer(blob.download_as_bytes())
+
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+
+        def write(start, data):
+            view[start:start + len(data)] = data
+
+        _download_ranges(blob, size, write)
+        _verify_crc32c(blob, view)
+        return pa.py_buffer(buffer)
+
+
+def download_blob_to_file(blob, path):
+    """
+    Downloads the blob's current generation to a local file, without holding it in memory: large objects are
+    written range by range at their offset, like download_blob. The file is checked against the object's CRC32C.
+    """
+    if blob.generation is None:
+        blob.reload()
+    size = blob.size or 0
+    with span("gcs.download_to_file", object=blob.name, bytes=size), open(path, "wb") as f:
+        if size < PARALLEL_DOWNLOAD_MIN_BYTES or DOWNLOAD_WORKERS <= 1:
+            f.write(blob.download_as_bytes(if_generation_match=blob.generation))
+            return path
+        f.truncate(size)
+        _download_ranges(blob, size, lambda start, data: os.pwrite(f.fileno(), data, start))
+    with pa.memory_map(path, "r") as mapped:
+        _verify_crc32c(blob, memoryview(mapped.read_buffer()))
+    return path
+
+
+def _verify_crc32c(blob, view, block_size=8 * 1024 * 1024):
+    if not blob.crc32c:
+        return
+    checksum = google_crc32c.Checksum()
+    for start in range(0, len(view), block_size):
+        checksum.update(bytes(view[start:start + block_size]))
+    actual = base64.b64encode(checksum.digest()).decode("utf-8")
+    if actual != blob.crc32c:
+        raise IOError(f"CRC32C mismatch for {blob.name}: expected {blob.crc32c}, got {actual}")
+
+
+def _projection(columns, filters):
+    """Columns to read: the requested ones plus any column a filter needs."""
+    if not columns:
+        return None
+    wanted = list(dict.fromkeys(columns))
+    wanted += [column for column, _, _ in filters or [] if column not in wanted]
+    return set(wanted)
+
+
+def _projected_columns(parquet_file, wanted, file_path):
+    if not wanted:
+        return None
+    read_columns = [col for col in parquet_file.schema_arrow.names if col in wanted]
+    total_columns = parquet_file.metadata.num_columns
+    if len(read_columns) < total_columns:
+        logging.debug(f"Column projection on {file_path}: reading {len(read_columns)}/{total_columns} columns.")
+    return read_columns
+
+
+def _select_row_groups(parquet_file, filters, file_path):
+    metadata = parquet_file.metadata
+    row_groups = list(range(metadata.num_row_groups))
+    if filters:
+        row_groups = [
+            i for i in row_groups
+            if all(_row_group_may_match(parquet_file, i, column, op, value) for column, op, value in filters)
+        ]
+        logging.info(f"Predicate pushdown on {file_path}: reading {len(row_groups)}/{metadata.num_row_groups} row groups.")
+    return row_groups
+
+
+def _iter_parquet_batches(source, wanted, filters, batch_size, file_path):
+    parquet_file = pq.ParquetFile(source, pre_buffer=True)
+    read_columns = _projected_columns(parquet_file, wanted, file_path)
+    row_groups = _select_row_groups(parquet_file, filters, file_path)
+    if not row_groups:
+        return
+    for batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups, columns=read_columns):
+        table = pa.Table.from_batches([batch])
+        for column, op, value in filters or []:
+            table = _filter_arrow_table(table, column, op, value)
+        yield table.to_pandas()
+
+
+def _read_parquet(source, wanted, filters, file_path):
+    return _read_parquet_table(source, wanted, filters, file_path).to_pandas()
+
+
+@traced("parquet.read_table")
+def _read_parquet_table(source, wanted, filters, file_path):
+    parquet_file = pq.ParquetFile(source, pre_buffer=True)
+    read_columns = _projected_columns(parquet_file, wanted, file_path)
+
+    row_groups = _select_row_groups(parquet_file, filters, file_path)
+    if row_groups:
+        table = parquet_file.read_row_groups(row_groups, columns=read_columns)
+    else:
+        schema = parquet_file.schema_arrow
+        if read_columns is not None:
+            schema = pa.schema([schema.field(col) for col in read_columns], metadata=schema.metadata)
+        table = schema.empty_table()
+    for column, op, value in filters or []:
+        table = _filter_arrow_table(table, column, op, value)
+    return table
+
+
+def _is_dataset(file_path):
+    return file_path.endswith("/")
+
+
+@traced("gcs.list_dataset_parts")
+def _list_dataset_parts(bucket, dataset_path, filters):
+    """Part paths of a dataset, skipping parts whose manifest statistics prove no row can match the filters."""
+    try:
+        manifest = json.loads(bucket.blob(f"{dataset_path}{DATASET_MANIFEST_NAME}").download_as_bytes())
+    except NotFound:
+        # No manifest: every Parquet file under the folder is a part
+        logging.warning(f"No manifest found for dataset {dataset_path}; listing its Parquet files.")
+        return sorted(blob.name for blob in bucket.list_blobs(prefix=dataset_path) if blob.name.endswith(".parquet"))
+
+    parts = manifest.get("parts", [])
+    selected = [
+        part["path"] for part in parts
+        if all(_part_may_match(part, column, op, value) for column, op, value in filters or [])
+    ]
+    if filters:
+        logging.info(f"Manifest pruning on {dataset_path}: reading {len(selected)}/{len(parts)} parts.")
+    return selected
+
+
+def _part_may_match(part, column, op, value):
+    stats = part.get("stats", {}).get(column)
+    if not stats or None in stats:
+        return True
+    value = _normalize_filter_value(value)
+    col_min, col_max = stats
+    if isinstance(value, pd.Timestamp):
+        col_min, col_max = _normalize_filter_value(pd.Timestamp(col_min)), _normalize_filter_value(pd.Timestamp(col_max))
+    return _range_may_match(col_min, col_max, op, value)
+
+
+def _read_dataset(bucket, dataset_path, wanted, filters):
+    tables = []
+    for part_path in _list_dataset_parts(bucket, dataset_path, filters):
+        with _parquet_source(bucket, bucket.blob(part_path), filters, immutable=True) as source:
+            tables.append(_read_parquet_table(source, wanted, filters, part_path))
+    if not tables:
+        return pd.DataFrame(columns=sorted(wanted or []))
+    try:
+        # Parts written months apart may disagree on types (e.g. an all-null column); let Arrow promote them
+        table = pa.concat_tables(tables, promote_options="permissive")
+    except (TypeError, pa.ArrowInvalid):
+        return pd.concat([table.to_pandas() for table in tables], ignore_index=True)
+    return table.to_pandas()
+
+
+def _normalize_filter_value(value):
+    """Makes datetime-like values comparable (pd.Timestamp, tz-aware values converted to naive UTC)."""
+    if isinstance(value, (datetime, date, pd.Timestamp, np.datetime64)):
+        value = pd.Timestamp(value)
+        if value.tzinfo is not None:
+            value = value.tz_convert("UTC").tz_localize(None)
+    return value
+
+
+def _row_group_may_match(parquet_file, row_group_index, column, op, value):
+    """Returns False only when the row group statistics prove that no row can satisfy `column op value`."""
+    column_index = parquet_file.schema_arrow.get_field_index(column)
+    if column_index < 0:
+        return True
+    statistics = parquet_file.metadata.row_group(row_group_index).column(column_index).statistics
+    if statistics is None or not statistics.has_min_max:
+        return True
+
+    col_min, col_max = _normalize_filter_value(statistics.min), _normalize_filter_value(statistics.max)
+    return _range_may_match(col_min, col_max, op, _normalize_filter_value(value))
+
+
+def _range_may_match(col_min, col_max, op, value):
+    """Returns False only when no value in [col_min, col_max] can satisfy `op value`."""
+    try:
+        if op in (">", ">="):
+            return FILTER_OPERATORS[op](col_max, value)
+        if op in ("<", "<="):
+            return FILTER_OPERATORS[op](col_min, value)
+        if op in ("==", "="):
+            return col_min <= value <= col_max
+        return True
+    except TypeError:
+        # Statistics and filter value are not comparable (e.g. timestamps stored as strings)
+        return True
+
+
+def _filter_scalar(value, field_type, column):
+    """The filter value as a scalar of the column's Arrow type; raises ValueError when it cannot be converted."""
+    if pa.types.is_timestamp(field_type):
+        value = _normalize_filter_value(value)
+        if field_type.tz is not None:
+            value = value.tz_localize("UTC")
+    try:
+        return pa.scalar(value, type=field_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, TypeError, ValueError):
+        pass
+    try:
+        return pa.scalar(value).cast(field_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, TypeError, ValueError) as e:
+        raise ValueError(f"Cannot compare column {column} of type {field_type} with filter value {value!r}: {e}") from e
+
+
+def _filter_arrow_table(table, column, op, value):
+    if column not in table.column_names:
+        return table
+    scalar = _filter_scalar(value, table.schema.field(column).type, column)
+    return table.filter(FILTER_OPERATORS[op](pc.field(column), scalar))
+
+
+def _filter_dataframe(df, filters):
+    for column, op, value in filters or []:
+        if column in df.columns:
+            df = df[FILTER_OPERATORS[op](df[column], value)]
+    return df
+
+
+def _source_object(file_path):
+    # A partitioned dataset changes whenever its manifest is rewritten
+    return f"{file_path}{DATASET_MANIFEST_NAME}" if _is_dataset(file_path) else file_path
+
+
+@traced("gcs.get_files_metadata")
+def get_files_metadata(bucket_name, file_paths):
+    """
+    Returns {file_path: {"generation", "md5_hash", "crc32c", "updated"}} for several files (None when a file is
+    missing), fetched with one listing whose glob matches exactly these objects instead of a request per file.
+    A partitioned dataset is described by its manifest.
+    """
+    client = get_gcs_client()
+    bucket = client.bucket(bucket_name)
+    objects = {_source_object(file_path): file_path for file_path in file_paths}
+    metadata = dict.fromkeys(file_paths)
+    if not objects:
+        return metadata
+
+    match_glob = "{" + ",".join(sorted(objects)) + "}"
+    for blob in bucket.list_blobs(prefix=os.path.commonprefix(list(objects)), match_glob=match_glob):
+        if blob.name in objects:
+            metadata[objects[blob.name]] = {
+                "generation": str(blob.generation),
+                "md5_hash": blob.md5_hash,
+                "crc32c": blob.crc32c,
+                "updated": blob.updated.isoformat() if blob.updated else None,
+            }
+    return metadata
+
+
 def get_file_last_modified_time(bucket_name, file_path):
     """
     Fetches the last modified time of a file in GCS and converts it to the desired timezone and format.
     """
     client = get_gcs_client()
     bucket = client.bucket(bucket_name)
-    blob = bucket.blob(file_path)
+    blob = bucket.blob(_source_object(file_path))
     
     try:
         # Fetch the metadata and check if the updated property exists
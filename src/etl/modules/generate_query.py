@@ -4,8 +4,13 @@ import re
 import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from requests.exceptions import Timeout
+from clickhouse_connect.driver.exceptions import DatabaseError, OperationalError
+import numpy as np
+import pandas as pd
+import pyarrow as pa
 
 # Global paths
 current_path = os.path.dirname(os.path.realpath(__file__))
@@ -13,7 +18,9 @@ parent_path = os.path.dirname(current_path)
 logs_path = os.path.join(parent_path, 'logs', '_modules', 'generatequery')
 sys.path.append(parent_path)
 
-from modules.db_connector import get_clickhouse_connection
+from modules.db_connector import get_clickhouse_connection, clickhouse_client
+from modules.metadata_cache import get_table_columns
+from logs.etl_tracing import span, traced
 
 
 # Helper function to load YAML config
@@ -62,54 +69,263 @@ def parse_values_row(row):
     return [value.replace("\n", " ") if isinstance(value, str) else value for value in values]
 
 
-# Retry logic for executing queries
-def execute_with_retries(query, client, retries=3, delay=5):
-    for attempt in range(retries):
+# ClickHouse error codes worth retrying: the server is busy or a replica/keeper was briefly unavailable
+TRANSIENT_ERROR_CODES = {
+    159,  # TIMEOUT_EXCEEDED
+    202,  # TOO_MANY_SIMULTANEOUS_QUERIES
+    209,  # SOCKET_TIMEOUT
+    210,  # NETWORK_ERROR
+    242,  # TABLE_IS_READ_ONLY
+    252,  # TOO_MANY_PARTS
+    279,  # ALL_CONNECTION_TRIES_FAILED
+    999,  # KEEPER_EXCEPTION
+}
+
+
+def is_transient_error(error):
+    """Timeouts, dropped connections, HTTP 5xx from a proxy and ClickHouse's transient error codes."""
+    if isinstance(error, (Timeout, ConnectionError, OperationalError)):
+        return True
+    if isinstance(error, DatabaseError):
+        code = getattr(error, "code", None)
+        if code is None:
+            match = re.search(r"\bcode:\s*(\d+)", str(error), re.IGNORECASE)
+            code = int(match.group(1)) if match else None
+        if code is not None:
+            return code in TRANSIENT_ERROR_CODES
+        return re.search(r"HTTP status 5\d\d", str(error)) is not None
+    return False
+
+
+# Retry logic for any ClickHouse call (query, insert_df, insert_arrow, ...): transient errors are retried with
+# exponential backoff, anything else (and the last transient error) is raised
+def call_with_retries(func, retries=3, delay=5):
+    for attempt in range(1, retries + 1):
         try:
-            client.query(query)
-            return
-        except Timeout as e:
-            logging.warning(f"⏳ Timeout (Attempt {attempt + 1}): {e}")
+            return func()
         except Exception as e:
-            logging.error(f"❌ Query execution failed: {e}", exc_info=True)
-            raise
+            if not is_transient_error(e) or attempt == retries:
+                logging.error(f"❌ Query execution failed (Attempt {attempt}/{retries}): {e}", exc_info=True)
+                raise
+            logging.warning(f"⏳ Transient ClickHouse error (Attempt {attempt}/{retries}), retrying in {delay}s: {e}")
         time.sleep(delay)
         delay *= 2
 
 
-# Batch insert function
-def insert_in_batches(data, client, database_name, table, col_names_str, batch_size=10000):
-    total_rows = len(data.split("\n"))
-    total_batches = (total_rows + batch_size - 1) // batch_size 
-    start_time = time.time() 
-    logging.debug(f"🚀 Starting batch insert: {total_rows} rows to insert.")
-    
-    for batch_num, start in enumerate(range(0, total_rows, batch_size), start=1):
-        batch_data = "\n".join(data.split("\n")[start:start + batch_size])
+# Retry logic for executing queries
+def execute_with_retries(query, client, retries=3, delay=5):
+    return call_with_retries(lambda: client.query(query), retries=retries, delay=delay)
+
+
+# Number of concurrent insert workers (each uses its own pooled connection)
+INSERT_WORKERS = int(os.getenv("CLICKHOUSE_INSERT_WORKERS", "1"))
+
+
+# Send row ranges [start, end) in batches, sequentially or concurrently over pooled connections
+def send_in_batches(total_rows, batch_size, send_batch, database_name, client=None, workers=INSERT_WORKERS, logger=None):
+    """
+    send_batch(start, end, client) sends one batch (with its own retries). With workers > 1 each batch
+    checks out a client from the connection pool; otherwise `client` (or the shared client) is used.
+    Logs per-batch latency and throughput and returns the overall rows/s.
+    """
+    logger = logger or logging.getLogger(__name__)
+    ranges = [(start, min(start + batch_size, total_rows)) for start in range(0, total_rows, batch_size)]
+    total_batches = len(ranges)
+    workers = max(1, min(workers, total_batches))
+    start_time = time.time()
+    logger.debug(f"🚀 Starting batch insert: {total_rows} rows to insert in {total_batches} batches ({workers} workers).")
+
+    def run_batch(batch_num, start, end):
         batch_start_time = time.time()
+        with span("clickhouse.insert_batch", batch=batch_num, rows=end - start):
+            if workers > 1:
+                with clickhouse_client(database_name) as pooled_client:
+                    send_batch(start, end, pooled_client)
+            else:
+                send_batch(start, end, client or get_clickhouse_connection(database_name))
+        batch_duration = time.time() - batch_start_time
+        rows_per_second = (end - start) / batch_duration if batch_duration else float("inf")
+        logger.info(f"✅ Batch {batch_num}/{total_batches} inserted successfully in {batch_duration:.2f}s ({end - start} rows, {rows_per_second:,.0f} rows/s)")
+        return batch_duration
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_batch, batch_num, start, end) for batch_num, (start, end) in enumerate(ranges, start=1)]
+            durations = [future.result() for future in futures]
+    else:
+        durations = [run_batch(batch_num, start, end) for batch_num, (start, end) in enumerate(ranges, start=1)]
+
+    total_duration = time.time() - start_time
+    throughput = total_rows / total_duration if total_duration else float("inf")
+    if durations:
+        logger.info(
+            f"✅ Insert completed: {total_rows} rows in {total_duration:.2f}s ({throughput:,.0f} rows/s, "
+            f"batch latency avg {sum(durations) / len(durations):.2f}s / max {max(durations):.2f}s)"
+        )
+    return throughput
+
+
+# Batch insert function
+@traced("clickhouse.insert_in_batches")
+def insert_in_batches(data, client, database_name, table, col_names_str, batch_size=10000, workers=INSERT_WORKERS):
+    rows = data.split("\n")  # Slice the payload once; each batch only joins its own rows
+
+    def send_batch(start, end, batch_client):
+        batch_data = "\n".join(rows[start:end])
         batch_insert_query = f"INSERT INTO {database_name}.{table} ({col_names_str}) VALUES {batch_data};"
-        
-        execute_with_retries(batch_insert_query, client)
+        execute_with_retries(batch_insert_query, batch_client)
+
+    send_in_batches(len(rows), batch_size, send_batch, database_name, client=client, workers=workers, logger=logging.getLogger())
+
+
+# Get (column name, column type) pairs of a ClickHouse table
+@traced("clickhouse.describe_table")
+def describe_table_columns(database_name, table):
+    return [(col[0], col[1]) for col in get_table_columns(database_name, table)]
+
+
+# Validate primary key values column-wise, return a boolean mask of valid rows
+def valid_primary_key_mask(values, pk_type):
+    """
+    Vectorized counterpart of the per-row `is_valid_pk` check used by the VALUES path.
+    """
+    if pk_type.startswith(("UInt", "Int", "Float")):
+        numbers = pd.to_numeric(values, errors="coerce")
+        mask = numbers.notna() & np.isfinite(numbers.astype("float64"))
+        if pk_type.startswith(("UInt", "Int")):
+            mask &= numbers == np.floor(numbers)
+        if pk_type.startswith("UInt"):
+            mask &= numbers >= 0
+        return mask.fillna(False).astype(bool)
+    if pk_type.startswith("String"):
+        return pd.Series(True, index=values.index)
+    logging.warning(f"❌ Unknown primary key type '{pk_type}' for column '{values.name}'")
+    return pd.Series(False, index=values.index)
+
+
+# Optimize the table (or one partition of it) after insert/update
+def optimize_table(database_name, table, logger=None, client=None, partition_id=None, final=False):
+    logger = logger or logging.getLogger(__name__)
+    client = client or get_clickhouse_connection(database_name)
+    optimize_query = f"OPTIMIZE TABLE {database_name}.{table}"
+    if partition_id:
+        optimize_query += f" PARTITION ID '{partition_id}'"
+    if final:
+        optimize_query += " FINAL"
+    logger.debug(f"⚙️ Optimizing table with query: {optimize_query}")
+    with span("clickhouse.optimize", table=f"{database_name}.{table}", partition=partition_id or "", final=final):
+        client.query(optimize_query)
+
+
+# Native columnar insert of a DataFrame (no VALUES string round trip)
+@traced("clickhouse.insert_dataframe")
+def insert_dataframe(database_name, table, df, logger=None, insert_format="native", batch_size=100000, optimize=False, workers=INSERT_WORKERS):
+    """
+    Sends the transformed DataFrame to ClickHouse using clickhouse_connect's binary insert APIs.
+
+    insert_format:
+        - "native": `client.insert_df`, columns are serialized in ClickHouse Native format.
+        - "arrow": `client.insert_arrow`, the DataFrame is converted to an Arrow table once.
+    """
+    logger = logger or logging.getLogger(__name__)
+    if insert_format not in ("native", "arrow"):
+        raise ValueError("❌ Invalid insert format. Choose from 'native' or 'arrow'.")
+    client = get_clickhouse_connection(database_name)
 
-        batch_end_time = time.time() 
-        batch_duration = batch_end_time - batch_start_time
-        logging.info(f"✅ Batch {batch_num}/{total_batches} inserted successfully in {batch_duration:.2f}s")
+    try:
+        column_info = describe_table_columns(database_name, table)
+        if not column_info:
+            raise ValueError(f"❌ Table {database_name}.{table} has no columns.")
+        column_types = dict(column_info)
 
-    total_duration = time.time() - start_time  # Tính tổng thời gian chạy
-    logging.info(f"✅ Insert completed: {total_rows} rows in {total_duration:.2f}s")
+        # Only send the columns that exist in both the DataFrame and the table, in table order
+        column_names = [col for col, _ in column_info if col in df.columns]
+        if not column_names:
+            raise ValueError(f"❌ DataFrame has no columns in common with {database_name}.{table}.")
 
+        primary_key_col = "RECID" if "RECID" in column_types else column_info[0][0]
+        try:
+            primary_key_col = get_primary_key_col_from_yaml(database_name, table)
+        except ValueError as e:
+            logger.warning(f"🔑 Using default primary key {primary_key_col} due to error: {e}")
+
+        if primary_key_col in df.columns:
+            pk_type = column_types[primary_key_col]
+            valid_mask = valid_primary_key_mask(df[primary_key_col], pk_type)
+            invalid_count = int((~valid_mask).sum())
+            if invalid_count:
+                invalid_values = df.loc[~valid_mask, primary_key_col].head(10).tolist()
+                logger.error(f"❌ Skipping {invalid_count} row(s) with invalid primary key (type: '{pk_type}'), e.g. {invalid_values}")
+                df = df[valid_mask]
+        else:
+            logger.warning(f"🔑 Primary key column {primary_key_col} not found in data, skipping validation.")
+
+        logger.debug(f"✔️ Valid rows count: {len(df)}")
+        if df.empty:
+            logger.info("✨ No valid rows to insert.")
+            return
+
+        df = df[column_names]
+        column_type_names = [column_types[col] for col in column_names]
+
+        def send_batch(start, end, batch_client):
+            batch_df = df.iloc[start:end]
+            if insert_format == "native":
+                call_with_retries(lambda: batch_client.insert_df(
+                    table=table, df=batch_df, database=database_name,
+                    column_names=column_names, column_type_names=column_type_names))
+            else:
+                arrow_table = pa.Table.from_pandas(batch_df, preserve_index=False)
+                call_with_retries(lambda: batch_client.insert_arrow(table=table, arrow_table=arrow_table, database=database_name))
+
+        send_in_batches(len(df), batch_size, send_batch, database_name, client=client, workers=workers, logger=logger)
+
+        if optimize:
+            optimize_table(database_name, table, logger=logger, client=client)
+
+    except Exception as e:
+        logger.error(f"❌ Error inserting DataFrame: {e}", exc_info=True)
+        raise
 
-# Generate SQL query for INSERT or DELETE
-def generate_query(query_type, database_name, table, condition=None, data=None, logger=None):
 
+# Stream an encoded text payload (TabSeparated/CSV) into ClickHouse without re-parsing it
+@traced("clickhouse.insert_text_payload")
+def insert_text_payload(database_name, table, payload, column_names, input_format="TabSeparated", logger=None, optimize=False):
+    """
+    `payload` is a string or an iterable of chunk strings, e.g. `encode_sql_data(df, "TabSeparated", chunk_size=50000)`.
+    Chunks are encoded and sent lazily in a single INSERT request body.
+    """
+    logger = logger or logging.getLogger(__name__)
     client = get_clickhouse_connection(database_name)
+    chunks = [payload] if isinstance(payload, str) else payload
 
-    # Get column names and types
-    describe_query = f"DESCRIBE TABLE {database_name}.{table}"
+    try:
+        start_time = time.time()
+        client.raw_insert(
+            table=f"{database_name}.{table}",
+            column_names=list(column_names),
+            insert_block=(chunk.encode("utf-8") for chunk in chunks),
+            fmt=input_format,
+        )
+        logger.info(f"✅ {input_format} insert completed in {time.time() - start_time:.2f}s")
+
+        if optimize:
+            optimize_table(database_name, table, logger=logger, client=client)
+
+    except Exception as e:
+        logger.error(f"❌ Error inserting {input_format} payload: {e}", exc_info=True)
+        raise
+
+
+# Generate SQL query for INSERT or DELETE
+@traced("clickhouse.generate_query")
+def generate_query(query_type, database_name, table, condition=None, data=None, logger=None, optimize=False):
+
+    client = get_clickhouse_connection(database_name)
 
     try:
-        query_result = client.query(describe_query)
-        column_info = [(col[0], col[1]) for col in query_result.result_rows]  # Column name and type
+        # Get column names and types
+        column_info = describe_table_columns(database_name, table)
         column_names = [col[0] for col in column_info]
 
         if not column_names:
@@ -178,10 +394,9 @@ def generate_query(query_type, database_name, table, condition=None, data=None,
             new_data_string = ",\n".join([f"({','.join(map(str, row))})" for row in valid_rows])
             insert_in_batches(new_data_string, client, database_name, table, col_names_str)
 
-            # Optional: Optimize the table after insert/update
-            optimize_query = f"OPTIMIZE TABLE {database_name}.{table}"
-            logger.debug(f"⚙️ Optimizing table with query: {optimize_query}")
-            client.query(optimize_query)
+            # Optional: Optimize the whole table after insert/update (loads use merge_policy instead)
+            if optimize:
+                optimize_table(database_name, table, logger=logger, client=client)
 
         elif query_type == 'DELETE':
             if not condition:
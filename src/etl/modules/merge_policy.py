@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import yaml
+import logging
+import threading
+import pandas as pd
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+parent_path = os.path.dirname(current_path)
+sys.path.append(parent_path)
+
+from modules.db_connector import get_clickhouse_connection
+from modules.generate_query import optimize_table
+
+# "immediate": optimize touched partitions right after the load
+# "deferred": record touched partitions, merged later by scheduled_merge_job.py (off-peak)
+# "off": never optimize, leave it to ClickHouse background merges
+MERGE_MODE = os.getenv("ETL_MERGE_MODE", "immediate")
+
+# A partition with at most this many active parts is considered healthy and is not optimized
+MAX_HEALTHY_PARTS = int(os.getenv("ETL_MERGE_MAX_HEALTHY_PARTS", "4"))
+
+# Use OPTIMIZE ... FINAL (forces a merge even of a single part, so ReplacingMergeTree deduplicates fully)
+OPTIMIZE_FINAL = os.getenv("ETL_MERGE_FINAL", "0") == "1"
+
+PENDING_MERGES_FILE = os.getenv("ETL_PENDING_MERGES_FILE", os.path.join(parent_path, 'state', 'pending_merges.json'))
+
+_pending_lock = threading.Lock()
+
+
+# Partition column of a table (the column wrapped by toYYYYMM in its DDL), from models/clickhouse_models.yaml
+def get_partition_column(database_name, table_name):
+    config_path = os.path.join(parent_path, 'models', 'clickhouse_models.yaml')
+    with open(config_path, 'r') as file:
+        config = yaml.safe_load(file)
+    try:
+        return config['clickhouse']['databases'][database_name]['tables'][table_name].get('partition_by')
+    except KeyError:
+        return None
+
+
+# toYYYYMM partition ids touched by a loaded DataFrame
+def touched_partitions(df, partition_column):
+    if df is None or df.empty or not partition_column or partition_column not in df.columns:
+        return set()
+    values = pd.to_datetime(df[partition_column], errors='coerce').dropna()
+    return {str(partition) for partition in (values.dt.year * 100 + values.dt.month).unique()}
+
+
+# Active part count per partition id
+def get_partition_part_counts(database_name, table_name, partitions=None):
+    query = """
+        SELECT partition_id, count() AS parts
+        FROM system.parts
+        WHERE database = %(database)s AND table = %(table)s AND active
+    """
+    params = {'database': database_name, 'table': table_name}
+    if partitions:
+        query += " AND partition_id IN %(partitions)s"
+        params['partitions'] = tuple(sorted(partitions))
+    query += " GROUP BY partition_id"
+    conn = get_clickhouse_connection(database_name)
+    return {partition_id: parts for partition_id, parts in conn.query(query, parameters=params).result_rows}
+
+
+def optimize_partitions(database_name, table_name, partitions, final=OPTIMIZE_FINAL, max_healthy_parts=MAX_HEALTHY_PARTS, logger=None):
+    """Optimize only the given partitions, skipping those whose part count is already healthy."""
+    logger = logger or logging.getLogger(__name__)
+    if not partitions:
+        return []
+
+    part_counts = get_partition_part_counts(database_name, table_name, partitions)
+    to_optimize = sorted(p for p in partitions if part_counts.get(p, 0) > max_healthy_parts)
+    skipped = len(partitions) - len(to_optimize)
+    if skipped:
+        logger.info(f"⏭️ Skipping merge of {skipped} healthy partition(s) of {database_name}.{table_name} (<= {max_healthy_parts} parts).")
+
+    for partition_id in to_optimize:
+        logger.info(f"⚙️ Optimizing partition {partition_id} of {database_name}.{table_name} ({part_counts[partition_id]} parts).")
+        optimize_table(database_name, table_name, logger=logger, partition_id=partition_id, final=final)
+    return to_optimize
+
+
+def _read_pending():
+    if not os.path.exists(PENDING_MERGES_FILE):
+        return {}
+    with open(PENDING_MERGES_FILE, 'r') as f:
+        return json.load(f)
+
+
+def _write_pending(pending):
+    os.makedirs(os.path.dirname(PENDING_MERGES_FILE), exist_ok=True)
+    tmp_path = f"{PENDING_MERGES_FILE}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(pending, f, indent=2)
+    os.replace(tmp_path, PENDING_MERGES_FILE)
+
+
+def record_pending_merges(database_name, table_name, partitions):
+    with _pending_lock:
+        pending = _read_pending()
+        key = f"{database_name}.{table_name}"
+        pending[key] = sorted(set(pending.get(key, [])) | set(partitions))
+        _write_pending(pending)
+
+
+def run_pending_merges(final=OPTIMIZE_FINAL, max_healthy_parts=MAX_HEALTHY_PARTS, logger=None):
+    """Optimize every partition recorded by deferred loads; meant to run as a separate off-peak job."""
+    logger = logger or logging.getLogger(__name__)
+    with _pending_lock:
+        pending = _read_pending()
+
+    for key, partitions in pending.items():
+        database_name, table_name = key.split(".", 1)
+        optimize_partitions(database_name, table_name, set(partitions), final=final, max_healthy_parts=max_healthy_parts, logger=logger)
+
+        # Drop what was handled, keeping partitions recorded by loads that ran meanwhile
+        with _pending_lock:
+            current = _read_pending()
+            remaining = sorted(set(current.get(key, [])) - set(partitions))
+            if remaining:
+                current[key] = remaining
+            else:
+                current.pop(key, None)
+            _write_pending(current)
+
+
+# Entry point for loads: apply the configured merge mode to the partitions a load touched
+def apply_merge_policy(database_name, table_name, partitions, logger=None):
+    logger = logger or logging.getLogger(__name__)
+    if not partitions or MERGE_MODE == "off":
+        return
+    if MERGE_MODE == "deferred":
+        record_pending_merges(database_name, table_name, partitions)
+        logger.info(f"🕒 Deferred merge of {len(partitions)} partition(s) of {database_name}.{table_name}.")
+        return
+    optimize_partitions(database_name, table_name, partitions, logger=logger)
@@ -0,0 +1,146 @@
+import os
+import sys
+import json
+import time
+import yaml
+import logging
+import threading
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+parent_path = os.path.dirname(current_path)
+sys.path.append(parent_path)
+
+from modules.db_connector import get_clickhouse_connection
+from logs.etl_tracing import span
+
+# Seconds before cached metadata is revalidated against the server's schema version
+METADATA_TTL = int(os.getenv("CLICKHOUSE_METADATA_TTL", "300"))
+
+# Optional local file to persist metadata between runs (disabled when empty)
+METADATA_CACHE_FILE = os.getenv("CLICKHOUSE_METADATA_CACHE_FILE", "")
+
+COLUMNS_QUERY = """
+    SELECT table, name, type, default_kind, default_expression
+    FROM system.columns
+    WHERE database = %(database)s AND table IN %(tables)s
+    ORDER BY table, position
+"""
+
+# Fingerprint of every column definition; changes whenever DDL touches one of the tables
+SCHEMA_VERSION_QUERY = """
+    SELECT toString(cityHash64(groupArray(tuple(table, name, type, default_kind, default_expression))))
+    FROM (
+        SELECT table, name, type, default_kind, default_expression
+        FROM system.columns
+        WHERE database = %(database)s AND table IN %(tables)s
+        ORDER BY table, position
+    )
+"""
+
+_cache = {}  # database -> {"version": str, "loaded_at": float, "tables": {table: [(name, type, default_type, default_expression)]}}
+_cache_lock = threading.Lock()
+
+
+# Tables listed for a database in models/clickhouse_models.yaml
+def get_model_tables(database_name):
+    config_path = os.path.join(parent_path, 'models', 'clickhouse_models.yaml')
+    with open(config_path, 'r') as file:
+        config = yaml.safe_load(file)
+    tables = config['clickhouse']['databases'].get(database_name, {}).get('tables') or {}
+    return [props.get('table_name', name) for name, props in tables.items()]
+
+
+def _fetch_schema_version(client, database_name, tables):
+    result = client.query(SCHEMA_VERSION_QUERY, parameters={'database': database_name, 'tables': tuple(tables)})
+    return result.result_rows[0][0] if result.result_rows else ""
+
+
+def _fetch_columns(client, database_name, tables):
+    result = client.query(COLUMNS_QUERY, parameters={'database': database_name, 'tables': tuple(tables)})
+    metadata = {}
+    for table, name, col_type, default_kind, default_expression in result.result_rows:
+        metadata.setdefault(table, []).append((name, col_type, default_kind, default_expression))
+    return metadata
+
+
+def _read_cache_file(database_name, version):
+    if not METADATA_CACHE_FILE or not os.path.exists(METADATA_CACHE_FILE):
+        return None
+    try:
+        with open(METADATA_CACHE_FILE, 'r') as f:
+            entry = json.load(f).get(database_name)
+        if entry and entry.get('version') == version:
+            return {table: [tuple(col) for col in columns] for table, columns in entry['tables'].items()}
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ Ignoring unreadable metadata cache file {METADATA_CACHE_FILE}: {e}")
+    return None
+
+
+def _write_cache_file(database_name, version, tables):
+    if not METADATA_CACHE_FILE:
+        return
+    try:
+        content = {}
+        if os.path.exists(METADATA_CACHE_FILE):
+            with open(METADATA_CACHE_FILE, 'r') as f:
+                content = json.load(f)
+        content[database_name] = {'version': version, 'tables': tables}
+        tmp_path = f"{METADATA_CACHE_FILE}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(content, f)
+        os.replace(tmp_path, METADATA_CACHE_FILE)
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ Failed to persist metadata cache to {METADATA_CACHE_FILE}: {e}")
+
+
+def load_database_metadata(database_name, tables=None, force=False):
+    """
+    Returns {table: [(name, type, default_type, default_expression), ...]} for the model tables of a database,
+    loaded with one system.columns query and kept in memory.
+
+    After METADATA_TTL seconds the cache is revalidated with a single-row schema version query and only
+    reloaded when the version (a hash of every column definition) changed, i.e. after DDL.
+    """
+    tables = sorted(set(tables or get_model_tables(database_name)))
+    with _cache_lock:
+        entry = _cache.get(database_name)
+        fresh = entry and set(tables) <= set(entry['requested']) and time.time() - entry['loaded_at'] < METADATA_TTL
+        if fresh and not force:
+            return entry['tables']
+
+        client = get_clickhouse_connection(database_name)
+        if entry:
+            tables = sorted(set(tables) | set(entry['requested']))
+        with span("clickhouse.schema_version", database=database_name):
+            version = _fetch_schema_version(client, database_name, tables)
+
+        if entry and not force and entry['version'] == version and set(tables) <= set(entry['requested']):
+            entry['loaded_at'] = time.time()
+            return entry['tables']
+
+        metadata = None if force else _read_cache_file(database_name, version)
+        if metadata is None or not set(tables) <= set(metadata):
+            with span("clickhouse.describe_columns", database=database_name, tables=len(tables)):
+                metadata = _fetch_columns(client, database_name, tables)
+            _write_cache_file(database_name, version, metadata)
+            logging.debug(f"📚 Loaded metadata for {len(metadata)} table(s) in {database_name} (schema version {version}).")
+
+        _cache[database_name] = {'version': version, 'loaded_at': time.time(), 'requested': tables, 'tables': metadata}
+        return metadata
+
+
+# Columns of one table: [(name, type, default_type, default_expression), ...]
+def get_table_columns(database_name, table_name):
+    metadata = load_database_metadata(database_name)
+    if table_name not in metadata:
+        # Table not listed in the YAML models (or created since): load it alongside them
+        metadata = load_database_metadata(database_name, tables=list(metadata) + [table_name])
+    return metadata.get(table_name, [])
+
+
+def invalidate_metadata(database_name=None):
+    with _cache_lock:
+        if database_name:
+            _cache.pop(database_name, None)
+        else:
+            _cache.clear()
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import math
+import ast
 import os
 import sys 
 
@@ -9,9 +10,12 @@ parent_path = os.path.dirname(current_path)
 sys.path.append(parent_path)
 
 from modules.db_connector import get_clickhouse_connection
+from modules.metadata_cache import get_table_columns
+from logs.etl_tracing import traced
 from datetime import datetime
 
 
+@traced("clickhouse.fetch_last_synced_at")
 def fetch_table_last_synced_at(database_name, table_name):
     """
     Fetches the 'last_synced_at' timestamp from the given table in ClickHouse.
@@ -26,12 +30,10 @@ def fetch_table_last_synced_at(database_name, table_name):
     return result[0][0] if result else None
 
 
-# Fetch ClickHouse table schema
+# Fetch ClickHouse table schema (served from the shared metadata cache)
+@traced("schema.fetch_table_schema")
 def fetch_table_schema(database_name, table_name):
-    client = get_clickhouse_connection(database_name)
-    query = f"DESCRIBE TABLE {database_name}.{table_name}"
-    schema = client.query(query)
-    schema_data = schema.result_rows
+    schema_data = get_table_columns(database_name, table_name)
 
     # Return a dictionary with column name as key, and type, nullable, default_type, and default_expression as values
     return {
@@ -45,99 +47,164 @@ def fetch_table_schema(database_name, table_name):
     }
 
 
+# Numpy dtypes for non-nullable ClickHouse numeric types
+INTEGER_DTYPES = {
+    "Int8": "int8", "Int16": "int16", "Int32": "int32", "Int64": "int64",
+    "UInt8": "uint8", "UInt16": "uint16", "UInt32": "uint32", "UInt64": "uint64",
+}
+FLOAT_DTYPES = {"Float32": "float32", "Float64": "float64"}
+
+# Compiled transform plans keyed by the schema's column definitions
+_transform_plans = {}
+
+
+# Split a ClickHouse type string into (base type, type arguments, nullable)
+def parse_clickhouse_type(type_str):
+    """
+    e.g. "LowCardinality(Nullable(String))" -> ("String", "", True), "Decimal(32,16)" -> ("Decimal", "32,16", False)
+    """
+    nullable = False
+    while True:
+        for wrapper in ("LowCardinality(", "Nullable("):
+            if type_str.startswith(wrapper) and type_str.endswith(")"):
+                nullable = nullable or wrapper == "Nullable("
+                type_str = type_str[len(wrapper):-1]
+                break
+        else:
+            break
+    base, _, args = type_str.partition("(")
+    return base, args[:-1] if args.endswith(")") else args, nullable
+
+
+def _to_string(values, nullable):
+    nulls = values.isna()
+    converted = values.astype(str)
+    if nulls.any():
+        converted = converted.where(~nulls, None if nullable else "")
+    return converted
+
+
+def _to_integer(values, base, nullable):
+    numbers = np.trunc(pd.to_numeric(values, errors="coerce"))
+    # ±inf and values outside the target type would fail the cast or wrap around (UInt8 300 -> 44): treat them as
+    # missing, i.e. NULL or the type default. The upper bound is exclusive so Int64's max rounded to float is excluded.
+    limits = np.iinfo(INTEGER_DTYPES[base])
+    numbers = numbers.where((numbers >= limits.min) & (numbers < float(limits.max) + 1))
+    if nullable:
+        return numbers.astype(base)  # pandas nullable integer dtypes share ClickHouse's names (Int64, UInt8, ...)
+    return numbers.fillna(0).astype(INTEGER_DTYPES[base])
+
+
+def _to_float(values, dtype, nullable):
+    numbers = pd.to_numeric(values, errors="coerce").astype(dtype)
+    return numbers if nullable else numbers.fillna(0.0)
+
+
+def _to_boolean(values, nullable):
+    if nullable:
+        return values.astype("boolean")
+    # where() rather than fillna(): fillna on object columns relies on pandas' deprecated silent downcasting
+    return values.where(values.notna(), False).astype(bool)
+
+
+def _to_datetime(values, nullable, date_only):
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        timestamps = values
+    else:
+        timestamps = pd.to_datetime(values, errors="coerce")
+    if date_only:
+        timestamps = timestamps.dt.normalize()
+    # Dates with years before 2000 (e.g. AX's 1900-01-01 "no date") are treated as NULL
+    timestamps = timestamps.mask(timestamps.dt.year < 2000)
+    if not nullable:
+        # Same as ClickHouse inserting NULL into a non-nullable column: the type's default (epoch)
+        epoch = pd.Timestamp(0, tz=timestamps.dt.tz) if timestamps.dt.tz else pd.Timestamp(0)
+        timestamps = timestamps.fillna(epoch)
+    return timestamps
+
+
+def _compile_converter(base, nullable):
+    """Returns a vectorized function converting a Series to the column's target dtype (or None to keep as is)."""
+    if base in ("String", "FixedString", "Enum8", "Enum16", "Enum", "UUID"):
+        return lambda values: _to_string(values, nullable)
+    if base in INTEGER_DTYPES:
+        return lambda values: _to_integer(values, base, nullable)
+    if base in FLOAT_DTYPES:
+        dtype = FLOAT_DTYPES[base]
+        return lambda values: _to_float(values, dtype, nullable)
+    if base.startswith("Decimal"):
+        return lambda values: _to_float(values, "float64", nullable)
+    if base in ("Bool", "Boolean"):
+        return lambda values: _to_boolean(values, nullable)
+    if base in ("Date", "Date32"):
+        return lambda values: _to_datetime(values, nullable, date_only=True)
+    if base in ("DateTime", "DateTime64"):
+        return lambda values: _to_datetime(values, nullable, date_only=False)
+    return None
+
+
+def _compile_default(base, nullable, default_type, default_expression):
+    """Returns a function producing the scalar used to fill a column missing from the DataFrame."""
+    null_value = np.nan if nullable else 0
+    if default_type != "DEFAULT" or not default_expression:
+        return lambda: null_value
+    if base.startswith("DateTime"):
+        if "now()" in default_expression:
+            return lambda: pd.Timestamp(datetime.now())  # Evaluated per run, not at compile time
+        return lambda: pd.NaT
+    try:
+        value = ast.literal_eval(default_expression)
+    except (ValueError, SyntaxError):
+        value = default_expression if base == "String" else null_value
+    return lambda: value
+
+
+# Compile the schema once into a per-column conversion plan
+def compile_transform_plan(schema):
+    key = tuple(
+        (col, props["type"], props["default_type"], props["default_expression"])
+        for col, props in schema.items()
+    )
+    plan = _transform_plans.get(key)
+    if plan is None:
+        plan = []
+        for col, props in schema.items():
+            base, _, nullable = parse_clickhouse_type(props["type"])
+            nullable = nullable or props.get("nullable", False)
+            plan.append({
+                "column": col,
+                "convert": _compile_converter(base, nullable),
+                "default": _compile_default(base, nullable, props["default_type"], props["default_expression"]),
+            })
+        _transform_plans[key] = plan
+    return plan
+
+
 # Transform DataFrame columns to match ClickHouse schema
+@traced("schema.transform")
 def transform_dataframe_to_schema(df, schema, logger=None):
-    # Handle Date and DateTime columns to replace years in the 1900s (19xx) with NaT
-    missing_columns = []
+    plan = compile_transform_plan(schema)
 
-    for col in df.columns:
-        if col not in schema:
-            logger.warning(f"Column '{col}' is missing from the ClickHouse schema and will be skipped.")
-            missing_columns.append(col)
-            continue  # Skip the column if it's missing from the schema
-        # If the column is Date or DateTime, replace dates with years in the 1900s (19xx) with None
-        if df[col].dtype in ["datetime64[ns]", "datetime64[ns, UTC]"]:
-            mask = df[col].dt.year < 2000
-            df[col] = df[col].astype("object")  # Ensure object type for mixed values
-            df.loc[mask, col] = None
-
-    # Remove missing columns from df
-    if missing_columns:
-        df = df.drop(columns=missing_columns)
+    missing_columns = [col for col in df.columns if col not in schema]
+    for col in missing_columns:
         if logger:
-            logger.info(f"Dropped {len(missing_columns)} column(s) not in schema: {missing_columns}")
-
-    new_columns = {}
-    # Transform DataFrame columns to match ClickHouse schema
-    for col, props in schema.items():
-        dtype = props["type"]
-        nullable = props["nullable"]
-        default_type = props["default_type"]
-        default_expression = props["default_expression"]
-
-        # Handle missing columns based on type and default behavior
-        if col not in df.columns:
-            if default_type == "DEFAULT" and default_expression:
-                # Handle DateTime type (e.g., 'now()')
-                if "DateTime" in dtype:
-                    if "now()" in default_expression:
-                        new_columns[col] = [pd.to_datetime(datetime.now())] * len(df) # Set current timestamp for DateTime
-                    else:
-                        new_columns[col] = [np.nan] * len(df) # For other DateTime expressions, we handle as NaN for now
-                # Handle numeric types (Int32, Float64, etc.)
-                elif "Int" in dtype or "Float" in dtype:
-                    try:
-                        # Try to evaluate the default expression as a number
-                        new_columns[col] = [eval(default_expression)] * len(df)
-                    except:
-                        # If evaluation fails, set NaN or 0 based on nullability
-                        new_columns[col] = [np.nan if nullable else 0] * len(df)
-                # Handle string types (String, etc.)
-                elif "String" in dtype:
-                    new_columns[col] = [str(default_expression)] * len(df) # Use the expression as a string
-                else:
-                    # Handle any other types based on the expression
-                    new_columns[col] = [np.nan if nullable else 0] * len(df)
-            else:
-                # For other missing columns, assign NaN if nullable or 0 if not nullable
-                new_columns[col] = [np.nan if nullable else 0] * len(df)
-
+            logger.warning(f"Column '{col}' is missing from the ClickHouse schema and will be skipped.")
+    if missing_columns and logger:
+        logger.info(f"Dropped {len(missing_columns)} column(s) not in schema: {missing_columns}")
+
+    # Build each column in schema order with native dtypes; defaults are broadcast scalars
+    columns = {}
+    for step in plan:
+        col = step["column"]
+        if col in df.columns:
+            values = df[col]
+        else:
+            values = pd.Series(step["default"](), index=df.index)
             if logger:
                 logger.info(f"Added missing column '{col}' with default or null values.")
-            continue  
+        columns[col] = step["convert"](values) if step["convert"] else values
 
-        # Skip the column if it was initialized in new_columns (since it doesn't exist in df)
-        if col not in df.columns:
-            continue
-
-        # Transform columns to match schema types
-        if dtype == "String":
-            df[col] = df[col].astype(str).fillna('')
-        elif dtype in ["Int32", "Int64", "UInt8", "UInt16", "UInt32", "UInt64"]:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-        elif dtype in ["Float32", "Float64"]:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
-        elif dtype == "Boolean":
-            df[col] = df[col].astype('bool', errors='ignore').fillna(False)
-        elif dtype in ["Enum8", "Enum16", "UUID"]:
-            df[col] = df[col].astype(str).fillna('unknown')
-        elif dtype == "Date":
-            df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
-            df[col] = df[col].where(df[col].notnull(), None)
-        elif dtype == "DateTime":
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-            df[col] = df[col].where(df[col].notnull(), None)
-
-        # Handle nullable fields properly
-        if nullable:
-            df[col] = df[col].where(pd.notnull(df[col]), None)
-
-    if new_columns:
-        df = pd.concat([df, pd.DataFrame(new_columns)], axis=1)
-
-    # Ensure the column order matches the schema
-    ordered_columns = [col for col in schema.keys() if col in df.columns]
-    df = df[ordered_columns]
+    df = pd.DataFrame(columns, index=df.index)
 
     if logger:
         logger.info(f"Final DataFrame shape after schema transformation: {df.shape}")
@@ -171,6 +238,7 @@ def format_value(value):
 
 
 # Convert DataFrame into ClickHouse VALUES string.
+@traced("schema.prepare_sql_data")
 def prepare_sql_data(df):
     """
     Handles NULLs, types, and formatting issues.
@@ -190,6 +258,119 @@ def prepare_sql_data(df):
     return ',\n'.join(sql_rows)
 
 
+# Text input formats supported by the column-at-a-time encoder
+TEXT_INPUT_FORMATS = {
+    "VALUES": {"null": "NULL", "row_sep": ",\n", "field_sep": ",", "row_prefix": "(", "row_suffix": ")", "quote": "'"},
+    "TabSeparated": {"null": "\\N", "row_sep": "\n", "field_sep": "\t", "row_prefix": "", "row_suffix": "", "quote": ""},
+    "CSV": {"null": "\\N", "row_sep": "\n", "field_sep": ",", "row_prefix": "", "row_suffix": "", "quote": "\""},
+}
+
+
+# Escape a string column for the given text input format
+def _escape_strings(values, input_format):
+    if input_format == "VALUES":
+        return "'" + values.str.replace("\\", "\\\\", regex=False).str.replace("'", "''", regex=False) + "'"
+    if input_format == "TabSeparated":
+        return (values.str.replace("\\", "\\\\", regex=False)
+                      .str.replace("\t", "\\t", regex=False)
+                      .str.replace("\n", "\\n", regex=False))
+    return '"' + values.str.replace('"', '""', regex=False) + '"'
+
+
+# Scalar formatter for text input formats other than VALUES
+def _format_text_value(value, input_format):
+    if input_format == "VALUES":
+        return format_value(value)
+    spec = TEXT_INPUT_FORMATS[input_format]
+    if isinstance(value, str):
+        return _escape_strings(pd.Series([value]), input_format).iloc[0]
+    if isinstance(value, pd.Timestamp):
+        return f"{spec['quote']}{value.strftime('%Y-%m-%d %H:%M:%S')}{spec['quote']}"
+    formatted = format_value(value)
+    return spec["null"] if formatted == "NULL" else formatted
+
+
+# Format one column to ClickHouse text syntax (vectorized counterpart of format_value)
+def _encode_column(values, input_format="VALUES"):
+    spec = TEXT_INPUT_FORMATS[input_format]
+    null_token, quote = spec["null"], spec["quote"]
+    kind = values.dtype.kind if isinstance(values.dtype, np.dtype) else None
+
+    if kind == "b":
+        encoded = np.where(values.to_numpy(), "1", "0").astype(object)
+    elif kind in ("i", "u"):
+        encoded = values.to_numpy().astype(str).astype(object)
+    elif kind == "f":
+        numbers = values.to_numpy(dtype="float64")
+        finite = np.isfinite(numbers)
+        encoded = np.full(len(numbers), null_token, dtype=object)
+        encoded[finite] = np.char.mod("%.6f", numbers[finite]).astype(object)
+    elif kind == "M" or isinstance(values.dtype, pd.DatetimeTZDtype):
+        if isinstance(values.dtype, pd.DatetimeTZDtype):
+            values = values.dt.tz_localize(None)  # strftime formats the local wall time
+        seconds = values.to_numpy().astype("datetime64[s]")
+        formatted = np.char.replace(np.datetime_as_string(seconds, unit="s"), "T", " ").astype(object)
+        encoded = np.where(np.isnat(seconds), null_token, quote + formatted + quote)
+    elif (kind == "O" or isinstance(values.dtype, pd.StringDtype)) and pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty"):
+        nulls = values.isna()
+        encoded = _escape_strings(values.where(~nulls, ""), input_format).where(~nulls, null_token).to_numpy(dtype=object)
+    else:
+        # Mixed objects / extension dtypes: fall back to the scalar formatter, still one column at a time
+        encoded = np.array([_format_text_value(value, input_format) for value in values.tolist()], dtype=object)
+
+    return encoded
+
+
+# Convert DataFrame into a ClickHouse text payload, one column at a time.
+def encode_sql_data(df, input_format="VALUES", chunk_size=None):
+    """
+    Vectorized drop-in for `prepare_sql_data`. With input_format="VALUES" the output is byte-identical
+    to `prepare_sql_data(df)`; "TabSeparated" and "CSV" produce the matching ClickHouse input formats.
+    With chunk_size set, returns a generator of payloads of at most chunk_size rows instead of one string.
+    """
+    if input_format not in TEXT_INPUT_FORMATS:
+        raise ValueError(f"Unsupported input format: {input_format}. Choose from {list(TEXT_INPUT_FORMATS)}.")
+    if df.empty:
+        raise ValueError("No rows were successfully formatted for insertion.")
+
+    # iterrows() hands format_value the values of the common (interleaved) dtype, so cast the same way.
+    # With extension dtypes (e.g. Int64 with <NA>) the interleaved dtype depends on the data itself.
+    if all(isinstance(dtype, np.dtype) for dtype in df.dtypes):
+        common_dtype = df.iloc[:0].to_numpy().dtype
+    else:
+        common_dtype = df.to_numpy().dtype
+
+    if chunk_size:
+        return (
+            _encode_frame(df.iloc[start:start + chunk_size], input_format, common_dtype)
+            for start in range(0, len(df), chunk_size)
+        )
+    return _encode_frame(df, input_format, common_dtype)
+
+
+# Encode one DataFrame (or chunk) into a single payload string
+@traced("schema.encode_frame")
+def _encode_frame(df, input_format, common_dtype):
+    spec = TEXT_INPUT_FORMATS[input_format]
+
+    if common_dtype != object and common_dtype.kind in "biufM":
+        na_kwargs = {"na_value": np.nan} if common_dtype.kind == "f" else {}
+        columns = [
+            _encode_column(pd.Series(df.iloc[:, i].to_numpy(dtype=common_dtype, **na_kwargs)), input_format)
+            for i in range(df.shape[1])
+        ]
+    else:
+        columns = [_encode_column(df.iloc[:, i], input_format) for i in range(df.shape[1])]
+
+    field_sep, prefix, suffix = spec["field_sep"], spec["row_prefix"], spec["row_suffix"]
+    rows = (prefix + field_sep.join(fields) + suffix for fields in zip(*columns))
+    payload = spec["row_sep"].join(rows)
+    if input_format != "VALUES":
+        payload += "\n"
+    return payload
+
+
+@traced("clickhouse.max_modified_datetime")
 def get_max_modified_datetime_from_schema(database_name, table_name):
     """Get MAX(MODIFIEDDATETIME) from ClickHouse table to track ETL status."""
     query = f"""
@@ -201,6 +382,7 @@ def get_max_modified_datetime_from_schema(database_name, table_name):
     return result[0][0] if result else None
 
 
+@traced("clickhouse.update_last_synced_at")
 def update_last_synced_at_in_schema(database_name, table_name, new_last_synced_at, mod_min, mod_max, logger=None):
     """Update the last_synced_at column in the ClickHouse table."""
     if not new_last_synced_at:
@@ -0,0 +1,297 @@
+import os
+import sys
+import yaml
+import pandas as pd
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+parent_path = os.path.dirname(current_path)
+sys.path.append(parent_path)
+
+from modules.gcs_handler import read_gcs_file, iter_gcs_file_batches, get_files_metadata
+from modules.generate_query import generate_query, insert_dataframe, insert_text_payload
+from modules.merge_policy import get_partition_column, touched_partitions, apply_merge_policy
+from modules.schema_handler import fetch_table_last_synced_at, fetch_table_schema, transform_dataframe_to_schema, encode_sql_data
+from modules.watermark_store import check_watermark_store, get_watermark, get_watermarks, get_high_watermark, set_watermark
+from logs.etl_logger import setup_logger, track_performance, run_etl_pipeline, run_streaming_etl_pipeline
+
+SYNC_MODES = ("daily", "monthly")
+LOAD_MODES = ("native", "arrow", "tsv", "values")
+
+# Skip a job without reading its file when the file is the version the last successful run processed
+SKIP_UNCHANGED = os.getenv("ETL_SKIP_UNCHANGED", "1") == "1"
+
+
+def load_storage_config():
+    with open(f'{parent_path}/models/storage_models.yaml', "r") as f:
+        return yaml.safe_load(f)
+
+
+def load_clickhouse_models():
+    with open(f'{parent_path}/models/clickhouse_models.yaml', "r") as f:
+        return yaml.safe_load(f)
+
+
+# Tables that have both a GCS file and a ClickHouse model: {file_key: table_name}
+def get_configured_tables(database_name):
+    files = load_storage_config()["gcs"]["files"]
+    models = load_clickhouse_models()["clickhouse"]["databases"].get(database_name, {}).get("tables") or {}
+    return {key: models[key].get("table_name", key) for key in files if key in models}
+
+
+def _processed_sources(watermark_record):
+    """{mode: source_version} recorded with a watermark; daily and monthly runs share the record but not the file version."""
+    sources = ((watermark_record or {}).get("run_metadata") or {}).get("source") or {}
+    return {mode: version for mode, version in sources.items() if mode in SYNC_MODES}
+
+
+def is_source_processed(source_version, watermark_record, mode):
+    """
+    True when `source_version` (see gcs_handler.get_files_metadata) is the version recorded by the last run of
+    `mode`: same generation, or same MD5/CRC32C, i.e. the file was re-uploaded with identical content.
+    A file processed in daily mode is not processed for monthly mode, which also loads rows below the daily threshold.
+    """
+    processed = _processed_sources(watermark_record).get(mode)
+    if not source_version or not processed:
+        return False
+    return any(source_version.get(key) and source_version[key] == processed.get(key) for key in ("generation", "md5_hash", "crc32c"))
+
+
+def find_unchanged_tables(database_name, tables, mode):
+    """
+    Returns (unchanged file keys, {file_key: source_version}) for `tables` ({file_key: table_name}) in sync `mode`, using one
+    metadata listing for all files and one watermark query for all tables. No file is read.
+    """
+    config = load_storage_config()["gcs"]
+    paths = {key: config["files"][key] for key in tables}
+    metadata = get_files_metadata(config["bucket_name"], list(paths.values()))
+    records = get_watermarks(database_name, tables.values())
+    versions = {key: metadata[path] for key, path in paths.items()}
+    unchanged = [key for key, table_name in tables.items() if is_source_processed(versions[key], records.get(table_name), mode)]
+    return unchanged, versions
+
+
+class TableETLJob:
+    """
+    Extract/transform/load job for one table: reads the table's Parquet file from GCS, filters it
+    on MODIFIEDDATETIME against the table's high-watermark and loads it into ClickHouse.
+
+    - "daily" mode extracts rows modified since the watermark.
+    - "monthly" mode re-extracts the month before the watermark as well, to pick up late corrections.
+    State (extracted range, loaded partitions) lives on the instance, so several jobs can run in one process.
+    """
+
+    def __init__(self, file_key, database_name="prod_source", table_name=None, mode="daily", load_mode="native",
+                 stream_mode=False, stream_batch_rows=100000, max_in_flight_batches=2, query_type="INSERT",
+                 skip_unchanged=SKIP_UNCHANGED):
+        if mode not in SYNC_MODES:
+            raise ValueError(f"Unsupported sync mode: {mode}")
+        if load_mode not in LOAD_MODES:
+            raise ValueError(f"Unsupported load mode: {load_mode}")
+
+        config = load_storage_config()
+        self.bucket_name = config["gcs"]["bucket_name"]
+        self.file_path = config["gcs"]["files"].get(file_key)
+        if not self.file_path:
+            raise ValueError(f"Missing file path for key: {file_key}")
+
+        self.file_key = file_key
+        self.database_name = database_name
+        self.table_name = table_name or file_key
+        self.mode = mode
+        self.load_mode = load_mode  # "native"/"arrow": binary columnar insert, "tsv": streamed TabSeparated, "values": legacy INSERT ... VALUES string
+        self.stream_mode = stream_mode  # True: extract, transform and load in bounded batches instead of one DataFrame
+        self.stream_batch_rows = stream_batch_rows
+        self.max_in_flight_batches = max_in_flight_batches
+        self.query_type = query_type
+        self.skip_unchanged = skip_unchanged
+        self.job_name = f"{mode}_SRC_{self.table_name}"
+
+        # MODIFIEDDATETIME range and row count for the watermark update
+        self.extracted_mod_min = None
+        self.extracted_mod_max = None
+        self.extracted_rows = 0
+
+        # toYYYYMM partitions written by this run, merged according to the merge policy
+        self.loaded_partitions = set()
+
+        # Metadata of the source file fetched before extracting, recorded with the watermark
+        self.source_version = None
+
+    def get_last_synced_at(self):
+        """High-watermark from the watermark store, falling back to the legacy last_synced_at column."""
+        return get_high_watermark(self.database_name, self.table_name) or fetch_table_last_synced_at(self.database_name, self.table_name)
+
+    def get_threshold(self):
+        """Returns (operator, value) rows must satisfy on MODIFIEDDATETIME, or None for a full load."""
+        table_last_synced_at = self.get_last_synced_at()
+        if table_last_synced_at is None:
+            return None
+        if self.mode == "monthly":
+            return ">", table_last_synced_at - pd.DateOffset(months=1)
+        return ">=", table_last_synced_at
+
+    @staticmethod
+    def _apply_threshold(df, threshold):
+        if threshold is None:
+            return df
+        op, value = threshold
+        mask = df['MODIFIEDDATETIME'] > value if op == ">" else df['MODIFIEDDATETIME'] >= value
+        return df[mask].copy().reset_index(drop=True)
+
+    def _track_extracted_range(self, df):
+        batch_min, batch_max = df['MODIFIEDDATETIME'].min(), df['MODIFIEDDATETIME'].max()
+        self.extracted_mod_min = batch_min if self.extracted_mod_min is None else min(self.extracted_mod_min, batch_min)
+        self.extracted_mod_max = batch_max if self.extracted_mod_max is None else max(self.extracted_mod_max, batch_max)
+        self.extracted_rows += len(df)
+
+    @track_performance("Extract", retries=3, backoff=2)
+    def extract(self, logger):
+        """Extract data from GCS and filter based on MODIFIEDDATETIME."""
+        threshold = self.get_threshold()
+
+        # Only read the columns the ClickHouse table actually has
+        target_columns = list(fetch_table_schema(self.database_name, self.table_name))
+
+        # Push the threshold down to the Parquet reader so unchanged row groups are never downloaded
+        filters = [("MODIFIEDDATETIME", *threshold)] if threshold else None
+        df = read_gcs_file(self.bucket_name, self.file_path, columns=target_columns, filters=filters)
+
+        if 'MODIFIEDDATETIME' not in df.columns:
+            logger.error(f"MODIFIEDDATETIME column not found in the file {self.file_path}.")
+            return None
+
+        df['MODIFIEDDATETIME'] = pd.to_datetime(df['MODIFIEDDATETIME'], errors='coerce')
+        df.sort_values(by='MODIFIEDDATETIME', inplace=True)
+        df.reset_index(drop=True, inplace=True)
+
+        extracted_data = self._apply_threshold(df, threshold)
+        if extracted_data.empty:
+            logger.info(f"Skipping processing of {self.file_path}. The file is not newer than the table.")
+            self.record_source_version(logger)
+            return None
+
+        self.extracted_mod_min, self.extracted_mod_max, self.extracted_rows = None, None, 0
+        self._track_extracted_range(extracted_data)
+
+        logger.info(f"Extracted {len(extracted_data)} records from GCS.")
+        logger.debug(f"MODIFIEDDATETIME range in extracted data: {self.extracted_mod_min} → {self.extracted_mod_max}")
+        return extracted_data
+
+    def extract_batches(self, logger):
+        """Stream data from GCS batch by batch, filtered on MODIFIEDDATETIME."""
+        threshold = self.get_threshold()
+        target_columns = list(fetch_table_schema(self.database_name, self.table_name))
+        filters = [("MODIFIEDDATETIME", *threshold)] if threshold else None
+
+        for batch in iter_gcs_file_batches(self.bucket_name, self.file_path, columns=target_columns, filters=filters, batch_size=self.stream_batch_rows):
+            if 'MODIFIEDDATETIME' not in batch.columns:
+                logger.error(f"MODIFIEDDATETIME column not found in the file {self.file_path}.")
+                return
+
+            batch['MODIFIEDDATETIME'] = pd.to_datetime(batch['MODIFIEDDATETIME'], errors='coerce')
+            batch = self._apply_threshold(batch, threshold)
+            if batch.empty:
+                continue
+
+            # Track min & max MODIFIEDDATETIME across batches for the final update
+            self._track_extracted_range(batch)
+
+            logger.info(f"Extracted batch of {len(batch)} records from GCS.")
+            yield batch
+
+        if not self.extracted_rows:
+            self.record_source_version(logger)
+
+    @track_performance("Transform", retries=3, backoff=2)
+    def transform(self, data, logger):
+        """Transform data according to table schema."""
+        if data is None or data.empty:
+            raise ValueError("No data to transform")
+        schema = fetch_table_schema(self.database_name, self.table_name)
+        transformed_data = transform_dataframe_to_schema(data, schema, logger=logger)
+        logger.info(f"Transformed {len(transformed_data)} records.")
+        return transformed_data
+
+    def insert_data(self, data, logger):
+        """Insert a transformed DataFrame into ClickHouse using the configured load mode."""
+        database_name, table_name = self.database_name, self.table_name
+        if self.load_mode in ("native", "arrow"):
+            logger.info(f"Loading {len(data)} records into {database_name}.{table_name} ({self.load_mode} insert).")
+            insert_dataframe(database_name, table_name, data, logger=logger, insert_format=self.load_mode)
+        elif self.load_mode == "tsv":
+            logger.info(f"Loading {len(data)} records into {database_name}.{table_name} (TabSeparated insert).")
+            chunks = encode_sql_data(data, input_format="TabSeparated", chunk_size=50000)
+            insert_text_payload(database_name, table_name, chunks, data.columns, logger=logger)
+        else:
+            prepared_data = encode_sql_data(data)
+            if not prepared_data:
+                logger.error("No prepared data to load.")
+                return
+            logger.info(f"Loading {len(data)} records into {database_name}.{table_name}.")
+            generate_query(query_type=self.query_type, database_name=database_name, table=table_name, data=prepared_data, logger=logger)
+            logger.info(f"Query of type '{self.query_type}' for table {database_name}.{table_name} has been generated.")
+
+    def update_sync_status(self, logger):
+        """After successful insert, record the new high-watermark (no ALTER TABLE UPDATE on the fact table)."""
+        set_watermark(self.database_name, self.table_name, self.extracted_mod_max, mod_min=self.extracted_mod_min,
+                      mod_max=self.extracted_mod_max, rows_loaded=self.extracted_rows, job_name=self.job_name,
+                      run_metadata=self._run_metadata(get_watermark(self.database_name, self.table_name)), logger=logger)
+
+    def _run_metadata(self, previous_record):
+        """Run metadata with this mode's source version, keeping the version the other mode processed."""
+        if not self.source_version:
+            return {}
+        return {"source": {**_processed_sources(previous_record), self.mode: self.source_version}}
+
+    def record_source_version(self, logger):
+        """Records that the current source file had no new rows, so the next run can skip it without reading it."""
+        if not self.source_version:
+            return
+        record = get_watermark(self.database_name, self.table_name)
+        if record is None or is_source_processed(self.source_version, record, self.mode):
+            return
+        set_watermark(self.database_name, self.table_name, record["high_watermark"], mod_min=record.get("mod_min"),
+                      mod_max=record.get("mod_max"), rows_loaded=0, job_name=self.job_name,
+                      run_metadata={**(record.get("run_metadata") or {}), **self._run_metadata(record)}, logger=logger)
+
+    @track_performance("Load", retries=3, backoff=2)
+    def load(self, data, logger):
+        """Load data into ClickHouse."""
+        if data is None or data.empty:
+            raise ValueError("No data to load")
+
+        self.insert_data(data, logger)
+        self.loaded_partitions.update(touched_partitions(data, get_partition_column(self.database_name, self.table_name)))
+
+        # In stream mode every batch is loaded separately; merges and sync status run once in finalize()
+        if not self.stream_mode:
+            apply_merge_policy(self.database_name, self.table_name, self.loaded_partitions, logger=logger)
+            self.update_sync_status(logger)
+
+    @track_performance("Finalize", retries=3, backoff=2)
+    def finalize(self, logger):
+        """Run once after all streamed batches are loaded."""
+        apply_merge_policy(self.database_name, self.table_name, self.loaded_partitions, logger=logger)
+        self.update_sync_status(logger)
+
+    def run(self, source_version=None):
+        """
+        Runs the job through the (streaming) ETL pipeline; returns True on success.
+
+        `source_version` is the file metadata when the caller already fetched it and checked that the file changed
+        (main_ETL_runner does so for all tables at once). Otherwise it is fetched here and, with skip_unchanged,
+        a file identical to the one processed last time ends the job before anything is read.
+        Raises a RuntimeError when the watermark table is not deployed (see check_watermark_store).
+        """
+        check_watermark_store()
+        if source_version is None:
+            source_version = get_files_metadata(self.bucket_name, [self.file_path])[self.file_path]
+            if self.skip_unchanged and is_source_processed(source_version, get_watermark(self.database_name, self.table_name), self.mode):
+                setup_logger(self.job_name).info(f"⏭️ Skipping {self.job_name}: {self.file_path} is unchanged since the last {self.mode} run.")
+                return True
+        self.source_version = source_version
+
+        if self.stream_mode:
+            return run_streaming_etl_pipeline(self.job_name, self.extract_batches, self.transform, self.load,
+                                              finalize=self.finalize, max_in_flight_batches=self.max_in_flight_batches)
+        return run_etl_pipeline(self.job_name, self.extract, self.transform, self.load)
@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import logging
+import threading
+import pandas as pd
+from datetime import datetime
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+parent_path = os.path.dirname(current_path)
+sys.path.append(parent_path)
+
+from modules.db_connector import get_clickhouse_connection
+from logs.etl_tracing import traced
+
+# "clickhouse": small ReplacingMergeTree table (see src/clickhouse/prod_source/create_etl_watermarks_table.sql)
+# "local": JSON state file, for dev runs or when the ClickHouse table is not deployed
+WATERMARK_BACKEND = os.getenv("ETL_WATERMARK_BACKEND", "clickhouse")
+WATERMARK_DATABASE = os.getenv("ETL_WATERMARK_DATABASE", "prod_source")
+WATERMARK_TABLE = "etl_watermarks"
+LOCAL_STATE_FILE = os.getenv("ETL_WATERMARK_STATE_FILE", os.path.join(parent_path, 'state', 'watermarks.json'))
+
+WATERMARK_COLUMNS = ["database_name", "table_name", "high_watermark", "mod_min", "mod_max", "rows_loaded", "job_name", "run_metadata"]
+
+_local_lock = threading.Lock()
+_store_checked = False
+
+
+def _to_datetime(value):
+    if value is None or pd.isna(value):
+        return None
+    return pd.Timestamp(value).to_pydatetime()
+
+
+def _read_local_state():
+    if not os.path.exists(LOCAL_STATE_FILE):
+        return {}
+    with open(LOCAL_STATE_FILE, "r") as f:
+        return json.load(f)
+
+
+def check_watermark_store():
+    """
+    Raises a RuntimeError explaining how to deploy the watermark table when the ClickHouse backend is used and the
+    table does not exist, before any job extracts or loads data. Checked once per process.
+    """
+    global _store_checked
+    if WATERMARK_BACKEND == "local" or _store_checked:
+        return
+    conn = get_clickhouse_connection(WATERMARK_DATABASE)
+    if conn is None:
+        raise RuntimeError(f"Could not connect to ClickHouse to check the watermark table {WATERMARK_DATABASE}.{WATERMARK_TABLE}.")
+    try:
+        rows = conn.query(f"EXISTS TABLE {WATERMARK_DATABASE}.{WATERMARK_TABLE}").result_rows
+    except Exception as e:
+        raise RuntimeError(f"Could not check the watermark table {WATERMARK_DATABASE}.{WATERMARK_TABLE}: {e}") from e
+    if not rows or not rows[0][0]:
+        raise RuntimeError(
+            f"Watermark table {WATERMARK_DATABASE}.{WATERMARK_TABLE} does not exist. Create it with "
+            f"src/clickhouse/prod_source/create_etl_watermarks_table.sql, or set ETL_WATERMARK_BACKEND=local."
+        )
+    _store_checked = True
+
+
+# Latest watermark record of a table, or None if the table was never synced
+def get_watermark(database_name, table_name):
+    if WATERMARK_BACKEND == "local":
+        with _local_lock:
+            record = _read_local_state().get(f"{database_name}.{table_name}")
+        if not record:
+            return None
+        for key in ("high_watermark", "mod_min", "mod_max", "updated_at"):
+            record[key] = _to_datetime(record.get(key))
+        return record
+
+    query = f"""
+        SELECT {", ".join(WATERMARK_COLUMNS)}, updated_at
+        FROM {WATERMARK_DATABASE}.{WATERMARK_TABLE}
+        WHERE database_name = %(database_name)s AND table_name = %(table_name)s
+        ORDER BY updated_at DESC
+        LIMIT 1
+    """
+    conn = get_clickhouse_connection(WATERMARK_DATABASE)
+    rows = conn.query(query, parameters={"database_name": database_name, "table_name": table_name}).result_rows
+    if not rows:
+        return None
+    record = dict(zip(WATERMARK_COLUMNS + ["updated_at"], rows[0]))
+    record["run_metadata"] = json.loads(record["run_metadata"] or "{}")
+    return record
+
+
+# Latest watermark records of several tables in one query: {table_name: record}, tables never synced are left out
+def get_watermarks(database_name, table_names):
+    table_names = list(table_names)
+    if not table_names:
+        return {}
+    if WATERMARK_BACKEND == "local":
+        records = {table_name: get_watermark(database_name, table_name) for table_name in table_names}
+        return {table_name: record for table_name, record in records.items() if record}
+
+    query = f"""
+        SELECT {", ".join(WATERMARK_COLUMNS)}, updated_at
+        FROM {WATERMARK_DATABASE}.{WATERMARK_TABLE}
+        WHERE database_name = %(database_name)s AND table_name IN %(table_names)s
+        ORDER BY updated_at DESC
+        LIMIT 1 BY table_name
+    """
+    conn = get_clickhouse_connection(WATERMARK_DATABASE)
+    rows = conn.query(query, parameters={"database_name": database_name, "table_names": tuple(table_names)}).result_rows
+    records = {}
+    for row in rows:
+        record = dict(zip(WATERMARK_COLUMNS + ["updated_at"], row))
+        record["run_metadata"] = json.loads(record["run_metadata"] or "{}")
+        records[record["table_name"]] = record
+    return records
+
+
+# High-watermark (max MODIFIEDDATETIME loaded) of a table, or None
+def get_high_watermark(database_name, table_name):
+    record = get_watermark(database_name, table_name)
+    return record["high_watermark"] if record else None
+
+
+@traced("watermark.set")
+def set_watermark(database_name, table_name, high_watermark, mod_min=None, mod_max=None, rows_loaded=0, job_name="", run_metadata=None, logger=None):
+    """Record a table's new high-watermark and run metadata: one single-row insert, no mutation on the fact table."""
+    logger = logger or logging.getLogger(__name__)
+    if high_watermark is None or pd.isna(high_watermark):
+        logger.warning("No new high-watermark value to record.")
+        return
+
+    record = {
+        "database_name": database_name,
+        "table_name": table_name,
+        "high_watermark": _to_datetime(high_watermark),
+        "mod_min": _to_datetime(mod_min),
+        "mod_max": _to_datetime(mod_max),
+        "rows_loaded": int(rows_loaded or 0),
+        "job_name": job_name or "",
+        "run_metadata": json.dumps(run_metadata or {}, default=str),
+    }
+
+    if WATERMARK_BACKEND == "local":
+        with _local_lock:
+            state = _read_local_state()
+            state[f"{database_name}.{table_name}"] = {
+                **record,
+                "run_metadata": run_metadata or {},
+                "updated_at": datetime.now(),
+            }
+            os.makedirs(os.path.dirname(LOCAL_STATE_FILE), exist_ok=True)
+            tmp_path = f"{LOCAL_STATE_FILE}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f, default=str, indent=2)
+            os.replace(tmp_path, LOCAL_STATE_FILE)
+    else:
+        conn = get_clickhouse_connection(WATERMARK_DATABASE)
+        conn.insert(
+            table=WATERMARK_TABLE,
+            database=WATERMARK_DATABASE,
+            data=[[record[col] for col in WATERMARK_COLUMNS]],
+            column_names=WATERMARK_COLUMNS,
+        )
+
+    logger.info(f"Recorded watermark {record['high_watermark']} for {database_name}.{table_name} ({record['rows_loaded']} rows loaded).")
@@ -0,0 +1,43 @@
+import os
+import sys
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(current_path)
+
+import argparse
+from modules.merge_policy import MAX_HEALTHY_PARTS, OPTIMIZE_FINAL, get_partition_part_counts, optimize_partitions, run_pending_merges
+from modules.metadata_cache import get_model_tables
+from logs.etl_logger import setup_logger
+
+# Off-peak merge job: optimizes the partitions recorded by loads running with ETL_MERGE_MODE=deferred,
+# or (--all-tables) every partition of the model tables whose part count is above the healthy limit.
+job_name = "scheduled_merge"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run deferred, partition-scoped merges for ETL tables.")
+    parser.add_argument("--database", default="prod_source", help="Database used with --all-tables.")
+    parser.add_argument("--all-tables", action="store_true", help="Scan system.parts of every model table, not only pending partitions.")
+    parser.add_argument("--final", action="store_true", default=OPTIMIZE_FINAL, help="Use OPTIMIZE ... FINAL.")
+    parser.add_argument("--max-healthy-parts", type=int, default=MAX_HEALTHY_PARTS, help="Skip partitions with at most this many active parts.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logger = setup_logger(job_name)
+    logger.info(f"Scheduled merge started (final={args.final}, max healthy parts={args.max_healthy_parts})")
+
+    try:
+        run_pending_merges(final=args.final, max_healthy_parts=args.max_healthy_parts, logger=logger)
+
+        if args.all_tables:
+            for table_name in get_model_tables(args.database):
+                partitions = set(get_partition_part_counts(args.database, table_name))
+                optimize_partitions(args.database, table_name, partitions, final=args.final,
+                                    max_healthy_parts=args.max_healthy_parts, logger=logger)
+
+        logger.info("Scheduled merge completed.")
+    except Exception as e:
+        logger.critical(f"Scheduled merge failed — Error: {e}", exc_info=True)
+        raise